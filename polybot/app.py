@@ -1,29 +1,139 @@
 import flask
 from flask import request
 import os
-from bot import Bot, QuoteBot, ImageProcessingBot
+import signal
+import sys
+import threading
+import time
+from loguru import logger
+from bot import Bot, QuoteBot, ImageProcessingBot, ObjectDetectionBot
+from updates import UpdateDispatcher
+from polybot.img_parallel import shutdown_pools
+# The same registry bot.py records into
+from polybot.metrics import metrics
 
 app = flask.Flask(__name__)
 
 TELEGRAM_TOKEN = os.environ['TELEGRAM_TOKEN']
 TELEGRAM_APP_URL = os.environ['TELEGRAM_APP_URL']
+UPDATE_WORKERS = int(os.environ.get('UPDATE_WORKERS', 4))
 
 
 @app.route('/', methods=['GET'])
 def index():
+    # Liveness: answers as soon as the process serves HTTP
+    return 'Ok'
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    # Readiness: the webhook is registered with Telegram
+    if not bot.started:
+        return 'Starting', 503
     return 'Ok'
 
 
 @app.route(f'/{TELEGRAM_TOKEN}/', methods=['POST'])
 def webhook():
-    req = request.get_json()
-    bot.handle_message(req['message'])
+    # Acknowledge right away, the update is handled in the background (redeliveries are ignored)
+    dispatcher.dispatch(request.get_json())
     return 'Ok'
 
 
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return bot.result_cache.stats()
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/metrics/trace/<path:job_id>', methods=['GET'])
+def get_trace(job_id):
+    # job_id is <chat id>/<message id>
+    if not metrics.allows_debug(request.headers.get('X-Debug-Token')):
+        flask.abort(404)
+    return {'id': job_id, 'spans': metrics.trace(job_id)}
+
+
+@app.route('/metrics/profiler', methods=['GET', 'POST'])
+def profiler():
+    # POST ?enabled=1[&interval=0.01] starts sampling, ?enabled=0 stops it; GET returns the collapsed stacks.
+    # This server is the public webhook: only requests with the X-Debug-Token header get here
+    if not metrics.allows_debug(request.headers.get('X-Debug-Token')):
+        flask.abort(404)
+    if request.method == 'POST':
+        if request.args.get('enabled', '1').lower() in ('1', 'true', 'yes'):
+            metrics.start_profiler(float(request.args.get('interval', 0.01)))
+        else:
+            metrics.stop_profiler()
+        return 'Ok'
+
+    if metrics.profiler is None:
+        return 'Profiler was never started', 404
+    return flask.Response(metrics.profiler.collapsed(int(request.args.get('top', 100))), mimetype='text/plain')
+
+
+def register_gauges():
+    metrics.gauge('updates_pending', dispatcher.pending)
+    if isinstance(bot, ImageProcessingBot):
+        metrics.gauge('processing_jobs_queued', lambda: bot.scheduler.stats()['queued'])
+        metrics.gauge('processing_jobs_running', lambda: bot.scheduler.stats()['running'])
+        metrics.gauge('media_groups_pending', bot.media_groups.pending)
+        metrics.counter('result_cache_hits_total', lambda: bot.result_cache.hits)
+        metrics.counter('result_cache_misses_total', lambda: bot.result_cache.misses)
+    if isinstance(bot, ObjectDetectionBot):
+        metrics.gauge('detection_jobs_queued', lambda: bot.scheduler.stats()['queued'])
+        metrics.gauge('detection_requests_in_flight', lambda: bot.detection_client.in_flight)
+        metrics.gauge('detection_circuit_open', lambda: int(bot.detection_client.breaker.state == 'open'))
+
+
+def handle_update(update):
+    # Only new messages are handled, other update types (edits, callbacks, ...) are ignored
+    if 'message' in update:
+        bot.handle_message(update['message'])
+
+
+def start_bot():
+    # Registering the webhook talks to Telegram, it runs in the background so health checks answer right away
+    while True:
+        try:
+            bot.start()
+            return
+        except Exception:
+            logger.exception('Registering the Telegram webhook failed, retrying in 5 seconds')
+            time.sleep(5)
+
+
+def shutdown():
+    # Drain the updates in flight first, they may still queue albums and processing jobs
+    dispatcher.shutdown(wait=True)
+    if isinstance(bot, ImageProcessingBot):
+        bot.media_groups.flush()
+        bot.scheduler.shutdown(wait=True)
+    if isinstance(bot, ObjectDetectionBot):
+        bot.shutdown()
+    # Last, the drained jobs may still have been running bands in the pools
+    shutdown_pools()
+
+
 if __name__ == "__main__":
     #bot = QuoteBot(TELEGRAM_TOKEN, TELEGRAM_APP_URL)
     #bot = Bot(TELEGRAM_TOKEN, TELEGRAM_APP_URL)
     bot = ImageProcessingBot(TELEGRAM_TOKEN, TELEGRAM_APP_URL)
+    #bot = ObjectDetectionBot(TELEGRAM_TOKEN, TELEGRAM_APP_URL)
+    dispatcher = UpdateDispatcher(handle_update, workers=UPDATE_WORKERS)
+    register_gauges()
+    threading.Thread(target=start_bot, name='bot-start', daemon=True).start()
+    if os.environ.get('PROFILER_ENABLED', '').lower() in ('1', 'true', 'yes'):
+        metrics.start_profiler()
 
-    app.run(host='0.0.0.0', port=8443)
+    # SIGTERM unwinds app.run, so the jobs are drained while the interpreter still runs.
+    # Not in atexit: concurrent.futures refuses new executors by then, and concat and segment jobs create some
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        app.run(host='0.0.0.0', port=8443)
+    finally:
+        shutdown()
@@ -0,0 +1,394 @@
+"""
+Benchmarks of the Img filters on synthetic images of several sizes and on beatles.jpeg.
+
+Reports wall time, throughput and peak memory per operation, saves the results as JSON and compares
+them with a stored baseline:
+
+    python -m polybot.benchmark --output bench.json
+    python -m polybot.benchmark --baseline bench.json --time-threshold 0.2 --memory-threshold 0.1
+
+With --startup, the import and initialization cost of the services is measured too, each in a fresh
+interpreter (wall time, and the peak RSS of that process, its VmHWM, as memory).
+
+With --codecs, every image codec encodes and decodes each image as JPEG and PNG; the encoded size is
+reported next to the time, and decoding is also measured with a --max-dimension cap:
+
+    python -m polybot.benchmark --operations rotate --codecs pil matplotlib --max-dimension 1024
+
+With --convolution, every convolution strategy (and the automatic choice) runs box blurs of several
+sizes and the contour kernel, next to the dedicated Img.blur and Img.contour loops:
+
+    python -m polybot.benchmark --operations rotate --convolution
+
+Every step is timed in-process, its best of --repeats runs. Its memory is measured in a separate run,
+in a fresh interpreter: the high-water mark of that process is reset once the input is ready, the peak
+memory is how far its RSS then rose during the step. It covers everything the step allocates in this
+process, NumPy arrays and the buffers of C libraries (PIL) alike, but not band workers (workers=1 here).
+
+The process exits with status 1 when an operation regressed beyond the thresholds.
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from polybot.img_codecs import CODECS, get_codec
+from polybot.img_convolve import STRATEGIES
+from polybot.img_proc import Img
+
+DEFAULT_SIZES = (256, 1024, 4096)
+SAMPLE_IMAGE = Path(__file__).parent / 'test' / 'beatles.jpeg'
+
+# Steps are code run with the names of PRELUDE, `pixels` (the benchmark image) and what their setup defines
+PRELUDE = """
+import io
+import numpy as np
+from polybot.img_codecs import get_codec
+from polybot.img_convolve import box_kernel, CONTOUR_KERNEL
+from polybot.img_proc import Img
+"""
+IMG_SETUP = "img = Img('benchmark.png', pixels=pixels.copy())"
+
+# Operation name -> statement applying it to `img`, a fresh Img (concat gets a second image of the same size).
+# rotate only makes a strided view, so the contiguous copy its consumer (the encoder) makes is measured with it.
+# segment is left out: its bands are contiguous row ranges of the pixels, it copies and computes nothing
+OPERATIONS = {
+    'blur': 'img.blur()',
+    'contour': 'img.contour()',
+    'rotate': 'img.rotate()\nnp.ascontiguousarray(img.pixels)',
+    'salt_n_pepper': 'img.salt_n_pepper(seed=0)',
+    'concat': 'img.concat(Img(img.path, pixels=img.pixels))',
+    'gaussian_blur': 'img.gaussian_blur()',
+    'sharpen': 'img.sharpen()',
+    'sobel': 'img.sobel()',
+}
+
+# Box sizes the convolution strategies are compared on, against the summed-area table of Img.blur
+CONVOLUTION_BOX_SIZES = (3, 9, 25)
+
+CODEC_FORMATS = ('jpeg', 'png')
+DEFAULT_MAX_DIMENSION = 1024
+
+ROOT = Path(__file__).parent.parent
+# Startup step name -> code run in a fresh interpreter (from the repository root)
+STARTUP_TARGETS = {
+    'import_img_proc': 'import polybot.img_proc',
+    'import_bot': 'import polybot.bot',
+    'init_bot': 'from polybot.bot import ImageProcessingBot\nImageProcessingBot("123:benchmark", "https://localhost")',
+    'import_yolo5_app': 'import os, sys\nsys.path.insert(0, "yolo5")\nos.environ.setdefault("BUCKET_NAME", "benchmark")\n'
+                        'import app',
+}
+# VmHWM is the peak RSS of the probe alone: ru_maxrss survives fork and exec on Linux, so it would
+# report the (much larger) peak of the benchmark process that started the probe
+STARTUP_PROBE = """
+import time
+start = time.perf_counter()
+exec({code!r})
+seconds = time.perf_counter() - start
+with open('/proc/self/status') as status:
+    peak_memory = next(int(line.split()[1]) * 1024 for line in status if line.startswith('VmHWM:'))
+print(seconds, peak_memory)
+"""
+# One run of a step in a fresh interpreter. clear_refs resets VmHWM to the current RSS (Linux >= 4.0),
+# so the difference is the peak of the step alone, not of the imports and the input
+MEMORY_PROBE = """
+import numpy as np
+pixels = np.load({pixels_path!r})
+exec({prelude!r})
+exec({setup!r})
+
+def status(field):
+    with open('/proc/self/status') as status:
+        return next(int(line.split()[1]) * 1024 for line in status if line.startswith(field))
+
+with open('/proc/self/clear_refs', 'w') as clear_refs:
+    clear_refs.write('5')
+baseline = status('VmRSS:')
+exec({statement!r})
+print(status('VmHWM:') - baseline)
+"""
+
+
+def synthetic_pixels(size, seed=0):
+    """
+    A smooth gradient with noise on top, so filters see realistic (non-constant) neighbourhoods
+    """
+    rng = np.random.default_rng(seed)
+    gradient = np.add.outer(np.arange(size), np.arange(size)) * (255 / max(2 * size - 2, 1))
+    return (gradient + rng.normal(0, 16, (size, size))).clip(0, 255).astype(np.float32)
+
+
+def benchmark_images(sizes=DEFAULT_SIZES, sample_image=SAMPLE_IMAGE):
+    images = {f'synthetic_{size}': synthetic_pixels(size) for size in sizes}
+    if sample_image:
+        images[Path(sample_image).name] = Img(sample_image).pixels
+    return images
+
+
+def measure(operation, pixels, repeats=3):
+    """
+    Best wall time and the peak memory of running `operation` on a fresh Img of `pixels`
+    """
+    return measure_call(OPERATIONS[operation], IMG_SETUP, pixels, repeats)
+
+
+def measure_call(statement, setup, pixels, repeats=3):
+    """
+    Best wall time of `statement` over `repeats` runs, each after a fresh `setup`, and its peak memory
+    measured in a separate run (see measure_memory)
+    """
+    namespace = {'pixels': pixels}
+    exec(PRELUDE, namespace)
+    setup_code = compile(setup, '<setup>', 'exec')
+    statement_code = compile(statement, '<statement>', 'exec')
+    best_seconds = float('inf')
+
+    for _ in range(repeats):
+        exec(setup_code, namespace)
+        start = time.perf_counter()
+        exec(statement_code, namespace)
+        best_seconds = min(best_seconds, time.perf_counter() - start)
+
+    return best_seconds, measure_memory(statement, setup, pixels)
+
+
+def measure_memory(statement, setup, pixels):
+    """
+    How far the RSS of a fresh interpreter rises above its level after `setup` while running `statement`
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT), os.environ.get('PYTHONPATH')])))
+    with tempfile.TemporaryDirectory() as directory:
+        pixels_path = os.path.join(directory, 'pixels.npy')
+        np.save(pixels_path, pixels)
+        probe = MEMORY_PROBE.format(pixels_path=pixels_path, prelude=PRELUDE, setup=setup, statement=statement)
+        output = subprocess.run([sys.executable, '-c', probe], cwd=ROOT, env=env,
+                                capture_output=True, text=True, check=True).stdout
+    return int(output.split()[-1])
+
+
+def run_codecs(images, codecs=tuple(CODECS), formats=CODEC_FORMATS, max_dimension=DEFAULT_MAX_DIMENSION,
+               repeats=3):
+    """
+    Encode and decode time of every codec and format on `images` (name -> pixels), with the encoded size.
+    Decoding is measured in full and, for images larger than `max_dimension`, capped to it.
+    The codecs allocate most of their memory in C (PIL's image buffers), which tracemalloc does not see:
+    their peak memory only compares through measure_memory's fresh process.
+    """
+    results = []
+
+    for image_name, pixels in images.items():
+        height, width = pixels.shape
+        for codec_name in codecs:
+            codec = get_codec(codec_name)
+            for image_format in formats:
+                encoded = codec.encode(pixels, image_format)
+                setup = f'codec = get_codec({codec_name!r})\nencoded = codec.encode(pixels, {image_format!r})'
+                steps = {
+                    f'encode_{image_format}': f'codec.encode(pixels, {image_format!r})',
+                    f'decode_{image_format}': f'codec.decode(io.BytesIO(encoded), {image_format!r})',
+                }
+                if max_dimension and max(height, width) > max_dimension:
+                    steps[f'decode_{image_format}_max{max_dimension}'] = \
+                        f'codec.decode(io.BytesIO(encoded), {image_format!r}, {max_dimension!r})'
+
+                for step, statement in steps.items():
+                    seconds, peak_memory = measure_call(statement, setup, pixels, repeats)
+                    results.append({
+                        'operation': f'{codec_name}_{step}',
+                        'image': image_name,
+                        'width': width,
+                        'height': height,
+                        'seconds': seconds,
+                        'megapixels_per_second': height * width / 1e6 / seconds if seconds else float('inf'),
+                        'peak_memory_bytes': peak_memory,
+                        'encoded_bytes': len(encoded),
+                    })
+
+    return results
+
+
+def run_convolution(images, box_sizes=CONVOLUTION_BOX_SIZES, strategies=STRATEGIES, repeats=3):
+    """
+    Time of Img.convolve with every strategy (and 'auto', the cost model's choice) on box kernels of
+    `box_sizes` and on the contour kernel, and of the Img.blur and Img.contour loops they replace
+    """
+    kernels = {f'box{size}': f'box_kernel({size})' for size in box_sizes}
+    kernels['contour'] = 'CONTOUR_KERNEL'
+    steps = {}
+    for kernel_name, kernel in kernels.items():
+        for strategy in (*strategies, None):
+            steps[f'convolve_{kernel_name}_{strategy or "auto"}'] = \
+                (f'kernel = {kernel}', f"img.convolve(kernel, 'valid', {strategy!r})")
+    for size in box_sizes:
+        steps[f'blur_box{size}'] = ('', f'img.blur({size})')
+    steps['contour'] = ('', 'img.contour()')
+    results = []
+
+    for image_name, pixels in images.items():
+        height, width = pixels.shape
+        for step, (setup, statement) in steps.items():
+            seconds, peak_memory = measure_call(statement, f'{IMG_SETUP}\n{setup}', pixels, repeats)
+            results.append({
+                'operation': step,
+                'image': image_name,
+                'width': width,
+                'height': height,
+                'seconds': seconds,
+                'megapixels_per_second': height * width / 1e6 / seconds if seconds else float('inf'),
+                'peak_memory_bytes': peak_memory,
+            })
+
+    return results
+
+
+def measure_startup(code, repeats=3):
+    """
+    Best wall time of running `code` in a fresh interpreter, and the largest peak RSS of those runs
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT), os.environ.get('PYTHONPATH')])))
+    best_seconds = float('inf')
+    peak_memory = 0
+
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', STARTUP_PROBE.format(code=code)], cwd=ROOT, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        seconds, memory = output.split()[-2:]
+        best_seconds = min(best_seconds, float(seconds))
+        peak_memory = max(peak_memory, int(memory))
+
+    return best_seconds, peak_memory
+
+
+def run_startup(targets=tuple(STARTUP_TARGETS), repeats=3):
+    results = []
+    for target in targets:
+        seconds, peak_memory = measure_startup(STARTUP_TARGETS[target], repeats)
+        results.append({
+            'operation': target,
+            'image': 'startup',
+            'width': 0,
+            'height': 0,
+            'seconds': seconds,
+            'megapixels_per_second': 0.0,
+            'peak_memory_bytes': peak_memory,
+        })
+    return results
+
+
+def run_suite(operations=tuple(OPERATIONS), sizes=DEFAULT_SIZES, sample_image=SAMPLE_IMAGE, repeats=3):
+    results = []
+
+    for image_name, pixels in benchmark_images(sizes, sample_image).items():
+        height, width = pixels.shape
+        for operation in operations:
+            seconds, peak_memory = measure(operation, pixels, repeats)
+            results.append({
+                'operation': operation,
+                'image': image_name,
+                'width': width,
+                'height': height,
+                'seconds': seconds,
+                'megapixels_per_second': height * width / 1e6 / seconds if seconds else float('inf'),
+                'peak_memory_bytes': peak_memory,
+            })
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'time': time.time(),
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, time_threshold=0.2, memory_threshold=0.1):
+    """
+    Returns the results of `report` that are slower (or use more memory, or encode larger) than
+    the matching `baseline` results by more than the given relative thresholds (memory_threshold
+    also applies to encoded sizes)
+    """
+    baseline_results = {(r['operation'], r['image']): r for r in baseline['results']}
+    regressions = []
+
+    for result in report['results']:
+        reference = baseline_results.get((result['operation'], result['image']))
+        if reference is None:
+            continue
+
+        time_ratio = result['seconds'] / reference['seconds'] if reference['seconds'] else 1
+        memory_ratio = (result['peak_memory_bytes'] / reference['peak_memory_bytes']
+                        if reference['peak_memory_bytes'] else 1)
+
+        size_ratio = (result['encoded_bytes'] / reference['encoded_bytes']
+                      if reference.get('encoded_bytes') and 'encoded_bytes' in result else 1)
+
+        if time_ratio > 1 + time_threshold or max(memory_ratio, size_ratio) > 1 + memory_threshold:
+            regressions.append(dict(result, time_ratio=time_ratio, memory_ratio=memory_ratio, size_ratio=size_ratio))
+
+    return regressions
+
+
+def format_report(report):
+    lines = [f'{"operation":<32}{"image":<20}{"seconds":>10}{"MP/s":>10}{"peak MB":>10}{"encoded KB":>12}']
+    for r in report['results']:
+        encoded = f'{r["encoded_bytes"] / 2 ** 10:>12.1f}' if 'encoded_bytes' in r else ''
+        lines.append(f'{r["operation"]:<32}{r["image"]:<20}{r["seconds"]:>10.4f}'
+                     f'{r["megapixels_per_second"]:>10.1f}{r["peak_memory_bytes"] / 2 ** 20:>10.1f}{encoded}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--operations', nargs='+', choices=list(OPERATIONS), default=list(OPERATIONS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(DEFAULT_SIZES))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--no-sample-image', action='store_true', help='skip beatles.jpeg')
+    parser.add_argument('--startup', action='store_true', help='also measure import and initialization time')
+    parser.add_argument('--codecs', nargs='*', choices=list(CODECS),
+                        help='also measure encoding and decoding with these codecs (all when none is named)')
+    parser.add_argument('--convolution', action='store_true',
+                        help='compare the convolution strategies with the blur and contour loops')
+    parser.add_argument('--max-dimension', type=int, default=DEFAULT_MAX_DIMENSION,
+                        help='cap of the capped decode measured with --codecs')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--time-threshold', type=float, default=0.2, help='allowed relative slowdown')
+    parser.add_argument('--memory-threshold', type=float, default=0.1, help='allowed relative memory growth')
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.operations, args.sizes, None if args.no_sample_image else SAMPLE_IMAGE, args.repeats)
+    if args.codecs is not None:
+        images = benchmark_images(args.sizes, None if args.no_sample_image else SAMPLE_IMAGE)
+        report['results'] += run_codecs(images, args.codecs or tuple(CODECS), max_dimension=args.max_dimension,
+                                        repeats=args.repeats)
+    if args.convolution:
+        images = benchmark_images(args.sizes, None if args.no_sample_image else SAMPLE_IMAGE)
+        report['results'] += run_convolution(images, repeats=args.repeats)
+    if args.startup:
+        report['results'] += run_startup(repeats=args.repeats)
+    print(format_report(report))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(report, baseline, args.time_threshold, args.memory_threshold)
+        for r in regressions:
+            print(f'REGRESSION {r["operation"]} on {r["image"]}: '
+                  f'time x{r["time_ratio"]:.2f}, memory x{r["memory_ratio"]:.2f}, size x{r["size_ratio"]:.2f}')
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,63 @@
 import telebot
 from loguru import logger
+from concurrent.futures import ThreadPoolExecutor
+import functools
+from pathlib import Path
+import io
 import os
+import re
 import time
-from telebot.types import InputFile
+from telebot.types import InputFile, InputMediaPhoto
+from polybot.detection import (DEFAULT_ACQUIRE_TIMEOUT, DEFAULT_MAX_CONCURRENCY, DetectionClient,
+                               DetectionUnavailable, format_prediction, make_s3_client)
+from polybot.img_codecs import capped_size, codec_name, UnsupportedFormat
 from polybot.img_proc import Img
-# import boto3
-# import requests
+from polybot.img_tiles import TiledImg
+from polybot.jobs import DEFAULT_MAX_QUEUED, DEFAULT_WORKERS, JobScheduler, QueueFull
+from polybot.media_groups import DEFAULT_MAX_GROUPS, DEFAULT_TIMEOUT, MediaGroupAggregator
+from polybot.metrics import metrics
+from polybot.result_cache import DEFAULT_DISK_BYTES, DEFAULT_MEMORY_BYTES, ResultCache
+
+# Filters that can be chained in a single caption (e.g. "rotate, contour, blur"), by caption keyword
+PIPELINE_FILTERS = {
+    'gaussian blur': 'gaussian_blur',
+    'blur': 'blur',
+    'contour': 'contour',
+    'sharpen': 'sharpen',
+    'sobel': 'sobel',
+    'rotate': 'rotate',
+    'salt and pepper': 'salt_n_pepper',
+}
+CAPTION_STEP_SEPARATOR = re.compile(r',|;|->|\bthen\b')
+# Joins the Img methods of a pipeline into its operation name
+PIPELINE_OPERATION_SEPARATOR = ' -> '
+
+# Telegram media groups hold 2 to 10 photos
+MAX_ALBUM_SIZE = 10
+
+# Photos with at least this many pixels are blurred / contoured tile by tile on memory-mapped buffers
+TILED_PROCESSING_MIN_PIXELS = int(os.environ.get('TILED_PROCESSING_MIN_PIXELS', 4096 * 4096))
+
+# Photos with a longer side above this are decoded straight to that size (0: no cap)
+MAX_IMAGE_DIMENSION = int(os.environ.get('MAX_IMAGE_DIMENSION', 0)) or None
+
+# Filters whose result differs on every run, they are never served from the result cache
+RANDOM_FILTERS = {'salt_n_pepper'}
+
+
+def request_id(msg):
+    """
+    Identifies the processing of a message in logs and metrics traces
+    """
+    return f"{msg['chat']['id']}/{msg.get('message_id')}"
+
+
+def close_image(image):
+    """
+    Releases the scratch files and memory maps of a TiledImg (an Img holds nothing to release)
+    """
+    if isinstance(image, TiledImg):
+        image.close()
 
 
 class Bot:
@@ -14,13 +66,18 @@ class Bot:
         # create a new instance of the TeleBot class.
         # all communication with Telegram servers are done using self.telegram_bot_client
         self.telegram_bot_client = telebot.TeleBot(token)
+        self.token = token
+        self.telegram_chat_url = telegram_chat_url
+        self.started = False
 
-        # remove any existing webhooks configured in Telegram servers
-        self.telegram_bot_client.remove_webhook()
-        time.sleep(0.5)
-
-        # set the webhook URL
-        self.telegram_bot_client.set_webhook(url=f'{telegram_chat_url}/{token}/', timeout=60)
+    def start(self):
+        """
+        Registers the webhook with Telegram. Kept out of __init__, so the service can answer health
+        checks while this (blocking) round-trip is in flight.
+        """
+        # set the webhook URL, replacing any existing one
+        self.telegram_bot_client.set_webhook(url=f'{self.telegram_chat_url}/{self.token}/', timeout=60)
+        self.started = True
 
         logger.info(f'Telegram Bot information\n\n{self.telegram_bot_client.get_me()}')
 
@@ -33,25 +90,32 @@ class Bot:
     def is_current_msg_photo(self, msg):
         return 'photo' in msg
 
-    def download_user_photo(self, msg):
+    def download_user_photo_data(self, msg):
         """
-        Downloads the photos that sent to the Bot to `photos` directory (should be existed)
-        :return:
+        Downloads the photo that was sent to the Bot into memory
+        :return: the Telegram file path of the photo and its bytes
         """
         if not self.is_current_msg_photo(msg):
             raise RuntimeError(f'Message content of type \'photo\' expected')
 
         file_info = self.telegram_bot_client.get_file(msg['photo'][-1]['file_id'])
-        data = self.telegram_bot_client.download_file(file_info.file_path)
-        folder_name = file_info.file_path.split('/')[0]
+        return file_info.file_path, self.telegram_bot_client.download_file(file_info.file_path)
+
+    def download_user_photo(self, msg):
+        """
+        Downloads the photos that sent to the Bot to `photos` directory (should be existed)
+        :return:
+        """
+        file_path, data = self.download_user_photo_data(msg)
+        folder_name = file_path.split('/')[0]
 
         if not os.path.exists(folder_name):
             os.makedirs(folder_name)
 
-        with open(file_info.file_path, 'wb') as photo:
+        with open(file_path, 'wb') as photo:
             photo.write(data)
 
-        return file_info.file_path
+        return file_path
 
     def send_photo(self, chat_id, img_path):
         if not os.path.exists(img_path):
@@ -62,6 +126,28 @@ class Bot:
             InputFile(img_path)
         )
 
+    def send_photo_data(self, chat_id, data, file_name='photo.jpeg'):
+        self.telegram_bot_client.send_photo(
+            chat_id,
+            InputFile(io.BytesIO(data), file_name=file_name)
+        )
+
+    def send_photo_album(self, chat_id, photos, file_name='photo.jpeg'):
+        """
+        Sends encoded photos as media groups, one API call per MAX_ALBUM_SIZE photos
+        """
+        stem, suffix = os.path.splitext(file_name)
+        for start in range(0, len(photos), MAX_ALBUM_SIZE):
+            album = photos[start:start + MAX_ALBUM_SIZE]
+            if len(album) == 1:
+                self.send_photo_data(chat_id, album[0], file_name)
+                continue
+
+            self.telegram_bot_client.send_media_group(chat_id, [
+                InputMediaPhoto(InputFile(io.BytesIO(data), file_name=f'{stem}_{start + i}{suffix}'))
+                for i, data in enumerate(album)
+            ])
+
     def handle_message(self, msg):
         """Bot Main message handler"""
         logger.info(f'Incoming message: {msg}')
@@ -77,228 +163,365 @@ class QuoteBot(Bot):
 
 
 class ImageProcessingBot(Bot):
-    def __init__(self, token, telegram_chat_url):
+    def __init__(self, token, telegram_chat_url, result_cache=None, scheduler=None, save_to_disk=None,
+                 media_groups=None):
+        """
+        Photos are processed in memory from download to upload. `save_to_disk` (or the SAVE_PHOTOS_TO_DISK
+        environment variable) keeps the downloaded and processed files on disk, for debugging.
+        """
         super().__init__(token, telegram_chat_url)
-        self.processing_completed = True
+        if save_to_disk is None:
+            save_to_disk = os.environ.get('SAVE_PHOTOS_TO_DISK', '').lower() in ('1', 'true', 'yes')
+        self.save_to_disk = save_to_disk
+        self.media_groups = media_groups or MediaGroupAggregator(
+            self.handle_media_group,
+            timeout=float(os.environ.get('MEDIA_GROUP_TIMEOUT', DEFAULT_TIMEOUT)),
+            max_groups=int(os.environ.get('MEDIA_GROUP_MAX_PENDING', DEFAULT_MAX_GROUPS)),
+        )
+        self.scheduler = scheduler or JobScheduler(
+            workers=int(os.environ.get('PROCESSING_WORKERS', DEFAULT_WORKERS)),
+            max_queued=int(os.environ.get('PROCESSING_QUEUE_SIZE', DEFAULT_MAX_QUEUED)),
+        )
+        self.result_cache = result_cache or ResultCache(
+            max_memory_bytes=int(os.environ.get('RESULT_CACHE_MEMORY_BYTES', DEFAULT_MEMORY_BYTES)),
+            disk_dir=os.environ.get('RESULT_CACHE_DIR'),
+            max_disk_bytes=int(os.environ.get('RESULT_CACHE_DISK_BYTES', DEFAULT_DISK_BYTES)),
+        )
 
     def handle_message(self, msg):
-        if not self.processing_completed:
-            logger.info("Previous message processing is not completed. Ignoring current message.")
-            return
-
-        if "photo" in msg:
+        if "photo" in msg and "media_group_id" in msg:
+            # One part of an album, it is handled once all parts arrived
+            if not self.media_groups.add(msg):
+                self.send_text(msg['chat']['id'], "The bot is busy right now, please try again in a minute.")
+        elif "photo" in msg:
             # If the message contains a photo, check if it also has a caption
             if "caption" in msg:
-                caption = msg["caption"].lower()
-                # Check for different processing methods in the caption
-                if 'blur' in caption:
-                    self.process_image_blur(msg)
-                elif 'contour' in caption:
-                    self.process_image_contour(msg)
-                elif 'rotate' in caption:
-                    self.process_image_rotate(msg)
-                elif 'segment' in caption:
-                    self.process_image_segment(msg)
-                elif 'salt and pepper' in caption:
-                    self.process_image_salt_and_pepper(msg)
-                elif 'concat' in caption:
-                    self.process_image_concat(msg)
-                else:
-                    self.send_text(msg['chat']['id'],
-                                   "Unknown processing method. Please provide a valid method in the caption.")
-
+                self.queue_photo(msg)
             else:
                 logger.info("Received photo without a caption.")
         elif "text" in msg:
             super().handle_message(msg)  # Call the parent class method to handle text messages
 
-    def process_image(self, msg):
-        self.processing_completed = False
-
-        # Download the two photos sent by the user
-        image_path = self.download_user_photo(msg)
-        another_image_path = self.download_user_photo(msg)
-
-        # Create two different Img objects from the downloaded images
-        image = Img(image_path)
-        another_image = Img(another_image_path)
-
-        # Process the image using your custom methods (e.g., apply filter)
-        image.concat(another_image)  # Concatenate the two images
-
-        # Save the processed image to the specified folder
-        processed_image_path = image.save_img()
-
-        if processed_image_path is not None:
-            # Send the processed image back to the user
-            self.send_photo(msg['chat']['id'], processed_image_path)
-
-        self.processing_completed = True
-
-    def process_image_contur(self, msg):
-        self.processing_completed = False
+    def handle_media_group(self, msgs):
+        """
+        Handles all the photos of an album. Telegram puts the album caption on one of its messages.
+        """
+        caption = next((msg['caption'] for msg in msgs if 'caption' in msg), None)
+        if caption is None:
+            logger.info("Received album without a caption.")
+        elif 'concat' in caption.lower():
+            self.queue_job(msgs[0]['chat']['id'], lambda: self.process_image_concat(msgs), request_id(msgs[0]))
+        else:
+            # Any other method is applied to every photo of the album
+            for msg in msgs:
+                self.queue_photo(dict(msg, caption=caption))
+
+    def queue_photo(self, msg):
+        """
+        Schedules the processing of a captioned photo. Photos of one chat are processed in order,
+        photos of different chats in parallel.
+        """
+        self.queue_job(msg['chat']['id'], lambda: self.process_caption(msg), request_id(msg))
 
-        # Download the two photos sent by the user
-        image_path = self.download_user_photo(msg)
+    def queue_job(self, chat_id, job, job_id=None):
+        submitted = time.perf_counter()
 
-        # Create two different Img objects from the downloaded images
-        image = Img(image_path)
+        def timed_job():
+            metrics.observe('queue_wait', time.perf_counter() - submitted, job_id)
+            job()
 
-        # Process the image using your custom methods (e.g., apply filter)
-        image.contour()  # contur the image
+        try:
+            position = self.scheduler.submit(chat_id, timed_job)
+        except QueueFull:
+            logger.warning(f'Job queue is full, rejecting photo from chat {chat_id}')
+            self.send_text(chat_id, "The bot is busy right now, please try again in a minute.")
+            return
 
-        # Save the processed image to the specified folder
-        processed_image_path = image.save_img()
+        # Tell the user when their job has to wait for a worker (or for their previous photo)
+        if position:
+            self.send_text(chat_id, f"Queued, position {position}")
+
+    def process_caption(self, msg):
+        caption = msg["caption"].lower()
+        steps = [step.strip() for step in CAPTION_STEP_SEPARATOR.split(caption) if step.strip()]
+        # A chain only when every part names a filter: "Please, blur" is a plain blur request
+        if len(steps) > 1 and all(step in PIPELINE_FILTERS for step in steps):
+            self.process_image_pipeline(msg, steps)
+        # Check for different processing methods in the caption
+        elif 'gaussian blur' in caption:
+            self.process_image_gaussian_blur(msg)
+        elif 'blur' in caption:
+            self.process_image_blur(msg)
+        elif 'contour' in caption:
+            self.process_image_contour(msg)
+        elif 'sharpen' in caption:
+            self.process_image_sharpen(msg)
+        elif 'sobel' in caption:
+            self.process_image_sobel(msg)
+        elif 'rotate' in caption:
+            self.process_image_rotate(msg)
+        elif 'segment' in caption:
+            self.process_image_segment(msg)
+        elif 'salt and pepper' in caption:
+            self.process_image_salt_and_pepper(msg)
+        elif 'concat' in caption:
+            self.process_image_concat([msg])
+        else:
+            self.send_text(msg['chat']['id'],
+                           "Unknown processing method. Please provide a valid method in the caption.")
+
+    def load_image(self, msg, image_path, encoded=None, lazy=False, tiled=False):
+        """
+        Opens a downloaded photo (from `encoded` bytes if given, otherwise from `image_path`).
+        With `tiled`, a photo too large to be processed in memory is opened as a TiledImg, or None is
+        returned (and the user told) when it is not a JPEG.
+        """
+        photo = msg['photo'][-1]
+        width, height = capped_size((photo.get('width', 0), photo.get('height', 0)), MAX_IMAGE_DIMENSION)
+        if tiled and width * height >= TILED_PROCESSING_MIN_PIXELS:
+            logger.info(f'Processing {image_path} in tiles')
+            # Telegram sends photos as JPEG, other formats would have to be decoded whole first
+            try:
+                return TiledImg(image_path, encoded=encoded, max_dimension=MAX_IMAGE_DIMENSION)
+            except UnsupportedFormat:
+                logger.warning(f'{image_path} is too large to process in a format other than JPEG')
+                self.send_text(msg['chat']['id'], "This photo is too large to process, please send it as a JPEG.")
+                return None
+
+        return Img(image_path, lazy=lazy, encoded=encoded, max_dimension=MAX_IMAGE_DIMENSION)
+
+    def result_cache_key(self, image_id, operation):
+        """
+        Cache key of `operation` on the photo `image_id`, under the size cap and codec the result is made with
+        """
+        return self.result_cache.key(image_id, operation, MAX_IMAGE_DIMENSION, codec_name())
 
-        if processed_image_path is not None:
-            # Send the processed image back to the user
-            self.send_photo(msg['chat']['id'], processed_image_path)
+    def process_photo(self, msg, operation, apply, lazy=False, tiled=False):
+        """
+        Downloads the photo of `msg`, runs `apply(image)` on it and sends the result back
+        (as an album when the result is segmented). `tiled` allows TiledImg for very large photos,
+        for operations it supports.
+        Results are cached by the photo's file_unique_id and `operation` (unless a step of it is random),
+        a cache hit is sent straight back without downloading or processing anything.
+        """
+        chat_id = msg['chat']['id']
+
+        cache = RANDOM_FILTERS.isdisjoint(operation.split(PIPELINE_OPERATION_SEPARATOR))
+        cache_key = self.result_cache_key(msg['photo'][-1]['file_unique_id'], operation)
+        cached_result = self.result_cache.get(cache_key) if cache else None
+        if cached_result is not None:
+            logger.info(f'Result cache hit for {operation}, chat {chat_id}')
+            self.send_result(chat_id, cached_result)
+            return
 
-        self.processing_completed = True
+        job_id = request_id(msg)
+        if self.save_to_disk:
+            # Download the photo sent by the user
+            with metrics.span('download', job_id):
+                image_path = self.download_user_photo(msg)
+
+            # Create an Img (or a TiledImg for very large photos) from the downloaded image
+            with metrics.span('decode', job_id):
+                image = self.load_image(msg, image_path, lazy=lazy, tiled=tiled)
+            if image is None:
+                return
+
+            try:
+                # Process the image using your custom methods (e.g., apply filter)
+                with metrics.span('filter', job_id):
+                    apply(image)
+
+                # Save the processed image (or its segments) to the specified folder
+                with metrics.span('encode', job_id):
+                    processed_image_path = image.save_img()
+                    if isinstance(processed_image_path, list):
+                        result = [Path(path).read_bytes() for path in processed_image_path]
+                    else:
+                        result = Path(processed_image_path).read_bytes()
+            finally:
+                close_image(image)
+        else:
+            # Same steps, but the photo is decoded from the downloaded bytes and encoded into a buffer
+            with metrics.span('download', job_id):
+                image_path, data = self.download_user_photo_data(msg)
+            with metrics.span('decode', job_id):
+                image = self.load_image(msg, image_path, encoded=data, lazy=lazy, tiled=tiled)
+            if image is None:
+                return
+            try:
+                # Lazy pipelines only record their steps here, they run (and are timed) with the encode
+                with metrics.span('filter', job_id):
+                    apply(image)
+                with metrics.span('encode', job_id):
+                    if getattr(image, 'segments', None) is not None:
+                        result = image.encode_segments()
+                    else:
+                        result = image.encode()
+            finally:
+                close_image(image)
+
+        if cache:
+            self.result_cache.put(cache_key, result)
+        # Send the processed image back to the user
+        with metrics.span('upload', job_id):
+            self.send_result(chat_id, result, file_name=Path(image_path).name)
+
+    def send_result(self, chat_id, result, file_name='photo.jpeg'):
+        """
+        Sends an encoded photo, or a list of them (segments) as an album
+        """
+        if isinstance(result, list):
+            self.send_photo_album(chat_id, result, file_name)
+        else:
+            self.send_photo_data(chat_id, result, file_name)
 
     def process_image_rotate(self, msg):
-        self.processing_completed = False
-
-        # Download the two photos sent by the user
-        image_path = self.download_user_photo(msg)
-
-        # Create two different Img objects from the downloaded images
-        image = Img(image_path)
-
-        # Process the image using your custom methods (e.g., apply filter)
-        image.rotate()  # rotate the image
-
-        # Save the processed image to the specified folder
-        processed_image_path = image.save_img()
-
-        if processed_image_path is not None:
-            # Send the processed image back to the user
-            self.send_photo(msg['chat']['id'], processed_image_path)
-
-        self.processing_completed = True
+        self.process_photo(msg, 'rotate', lambda image: image.rotate())
 
     def process_image_blur(self, msg):
-        self.processing_completed = False
+        self.process_photo(msg, 'blur', lambda image: image.blur(), tiled=True)
 
-        # Download the two photos sent by the user
-        image_path = self.download_user_photo(msg)
-
-        # Create two different Img objects from the downloaded images
-        image = Img(image_path)
+    def process_image_contour(self, msg):
+        self.process_photo(msg, 'contour', lambda image: image.contour(), tiled=True)
 
-        # Process the image using your custom methods (e.g., apply filter)
-        image.blur()  # blur the image
+    def process_image_gaussian_blur(self, msg):
+        self.process_photo(msg, 'gaussian_blur', lambda image: image.gaussian_blur())
 
-        # Save the processed image to the specified folder
-        processed_image_path = image.save_img()
+    def process_image_sharpen(self, msg):
+        self.process_photo(msg, 'sharpen', lambda image: image.sharpen())
 
-        if processed_image_path is not None:
-            # Send the processed image back to the user
-            self.send_photo(msg['chat']['id'], processed_image_path)
+    def process_image_sobel(self, msg):
+        self.process_photo(msg, 'sobel', lambda image: image.sobel())
 
-        self.processing_completed = True
+    def process_image_segment(self, msg):
+        self.process_photo(msg, 'segment', lambda image: image.segment())
 
+    def process_image_salt_and_pepper(self, msg):
+        self.process_photo(msg, 'salt_n_pepper', lambda image: image.salt_n_pepper(), tiled=True)
 
-    def process_image_contour(self, msg):
-        self.processing_completed = False
+    def process_image_pipeline(self, msg, steps):
+        """
+        Applies `steps` (PIPELINE_FILTERS keywords) in order
+        """
+        def apply(image):
+            for step in steps:
+                getattr(image, PIPELINE_FILTERS[step])()
 
-        # Download the two photos sent by the user
-        image_path = self.download_user_photo(msg)
+        # The whole chain runs lazily on a single decode, fused and encoded once
+        self.process_photo(msg, PIPELINE_OPERATION_SEPARATOR.join(PIPELINE_FILTERS[step] for step in steps), apply,
+                           lazy=True)
 
-        # Create two different Img objects from the downloaded images
-        image = Img(image_path)
+    def process_image_concat(self, msgs):
+        """
+        Concatenates the photos of an album, left to right
+        """
+        chat_id = msgs[0]['chat']['id']
+        if len(msgs) < 2:
+            self.send_text(chat_id, "Please send at least two photos in one album, with the caption 'concat'.")
+            return
 
-        # Process the image using your custom methods (e.g., apply filter)
-        image.contour()  # contour the image
+        cache_key = self.result_cache_key(','.join(msg['photo'][-1]['file_unique_id'] for msg in msgs), 'concat')
+        cached_result = self.result_cache.get(cache_key)
+        if cached_result is not None:
+            logger.info(f'Result cache hit for concat, chat {chat_id}')
+            self.send_result(chat_id, cached_result)
+            return
 
-        # Save the processed image to the specified folder
-        processed_image_path = image.save_img()
+        job_id = request_id(msgs[0])
+        # Download all the photos at once
+        with metrics.span('download', job_id), ThreadPoolExecutor(max_workers=len(msgs)) as executor:
+            downloads = list(executor.map(self.download_user_photo_data, msgs))
 
-        if processed_image_path is not None:
-            # Send the processed image back to the user
-            self.send_photo(msg['chat']['id'], processed_image_path)
+        with metrics.span('decode', job_id):
+            images = [Img(image_path, encoded=data, max_dimension=MAX_IMAGE_DIMENSION) for image_path, data in downloads]
+        with metrics.span('filter', job_id):
+            image = images[0]
+            image.concat_all(images[1:])  # Concatenate the images
 
-        self.processing_completed = True
+        with metrics.span('encode', job_id):
+            result = image.encode()
+        self.result_cache.put(cache_key, result)
+        with metrics.span('upload', job_id):
+            self.send_result(chat_id, result, file_name=Path(downloads[0][0]).name)
 
-    def process_image_segment(self, msg):
-        self.processing_completed = False
 
-        # Download the two photos sent by the user
-        image_path = self.download_user_photo(msg)
+class ObjectDetectionBot(Bot):
+    def __init__(self, token, telegram_chat_url, bucket=None, yolo5_url=None, s3_client=None, detection_client=None,
+                 scheduler=None, s3_prefix=None):
+        """
+        Photos are uploaded to `bucket` (BUCKET_NAME) and the objects in them detected by the yolo5
+        service at `yolo5_url` (YOLO5_URL). Every photo is its own pipeline, download -> S3 upload ->
+        /predict -> reply, so one photo uploads while another is being predicted.
+        """
+        super().__init__(token, telegram_chat_url)
+        self.bucket = bucket or os.environ['BUCKET_NAME']
+        self.s3_prefix = os.environ.get('S3_PHOTOS_PREFIX', 'photos/') if s3_prefix is None else s3_prefix
+        if s3_client is not None:
+            self.s3 = s3_client
+        self.detection_client = detection_client or DetectionClient(
+            yolo5_url or os.environ.get('YOLO5_URL', 'http://yolo5:8081'),
+            timeout=(float(os.environ.get('YOLO5_CONNECT_TIMEOUT', 3.05)),
+                     float(os.environ.get('YOLO5_READ_TIMEOUT', 30))),
+            max_concurrency=int(os.environ.get('YOLO5_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY)),
+            acquire_timeout=float(os.environ.get('YOLO5_ACQUIRE_TIMEOUT', DEFAULT_ACQUIRE_TIMEOUT)),
+        )
+        self.scheduler = scheduler or JobScheduler(
+            workers=int(os.environ.get('DETECTION_WORKERS', 2 * DEFAULT_MAX_CONCURRENCY)),
+            max_queued=int(os.environ.get('DETECTION_QUEUE_SIZE', DEFAULT_MAX_QUEUED)),
+        )
 
-        # Create two different Img objects from the downloaded images
-        image = Img(image_path)
+    @functools.cached_property
+    def s3(self):
+        # Created on first use (importing boto3 is slow), then shared by all the pipelines
+        return make_s3_client(max_pool_connections=self.scheduler.workers)
 
-        # Process the image using your custom methods (e.g., apply filter)
-        image.segment()  # segment the image
+    def handle_message(self, msg):
+        logger.info(f'Incoming message: {msg}')
 
-        # Save the processed image to the specified folder
-        processed_image_path = image.save_img()
+        if not self.is_current_msg_photo(msg):
+            self.send_text(msg['chat']['id'], 'Please send a photo to detect the objects in it.')
+            return
 
-        if processed_image_path is not None:
-            # Send the processed image back to the user
-            self.send_photo(msg['chat']['id'], processed_image_path)
+        # Keyed by message rather than chat: the photos of a chat (or an album) run concurrently,
+        # each reply quotes its photo
+        try:
+            self.scheduler.submit(request_id(msg), lambda: self.detect_objects(msg))
+        except QueueFull:
+            logger.warning(f'Job queue is full, rejecting photo from chat {msg["chat"]["id"]}')
+            self.send_text(msg['chat']['id'], "The bot is busy right now, please try again in a minute.")
+
+    def photo_key(self, msg, file_path):
+        return f"{self.s3_prefix}{msg['chat']['id']}/{msg['message_id']}_{Path(file_path).name}"
+
+    def detect_objects(self, msg):
+        chat_id = msg['chat']['id']
+        job_id = request_id(msg)
+
+        try:
+            with metrics.span('download', job_id):
+                file_path, data = self.download_user_photo_data(msg)
+
+            # Straight from memory to S3, the photo never touches the disk
+            img_name = self.photo_key(msg, file_path)
+            with metrics.span('s3_upload', job_id):
+                self.s3.upload_fileobj(io.BytesIO(data), self.bucket, img_name)
+
+            with metrics.span('predict', job_id):
+                prediction = self.detection_client.predict(img_name)
+        except DetectionUnavailable as e:
+            logger.warning(f'{job_id}: {e}')
+            self.send_text_with_quote(chat_id, 'Object detection is unavailable right now, please try again later.',
+                                      quoted_msg_id=msg['message_id'])
+            return
+        except Exception:
+            logger.exception(f'{job_id}: object detection failed')
+            self.send_text_with_quote(chat_id, 'Object detection service error.', quoted_msg_id=msg['message_id'])
+            return
 
-        self.processing_completed = True
+        logger.info(f'{job_id}: prediction {prediction.get("prediction_id")} of {img_name}')
+        with metrics.span('reply', job_id):
+            self.send_text_with_quote(chat_id, format_prediction(prediction), quoted_msg_id=msg['message_id'])
 
-    def process_image_salt_and_pepper(self, msg):
-        self.processing_completed = False
-
-        # Download the two photos sent by the user
-        image_path = self.download_user_photo(msg)
-
-        # Create two different Img objects from the downloaded images
-        image = Img(image_path)
-
-        # Process the image using your custom methods (e.g., apply filter)
-        image.salt_and_pepper()  # salt_and_pepper the image
-
-        # Save the processed image to the specified folder
-        processed_image_path = image.save_img()
-
-        if processed_image_path is not None:
-            # Send the processed image back to the user
-            self.send_photo(msg['chat']['id'], processed_image_path)
-
-        self.processing_completed = True
-
-
-    def process_image_concat(self, msg):
-        pass
-        
-        
-# class ObjectDetectionBot(Bot):
-#    def handle_message(self, msg):
-#        logger.info(f'Incoming message: {msg}')
-#
-#       if self.is_current_msg_photo(msg):
-#            photo_path = self.download_user_photo(msg)
-#
-#           # Task 1: Upload the Photo to S3
-#            # Replace 'your-access-key', 'your-secret-key', 'your-bucket-name', and 'your-object-key' with your S3 credentials and desired locations.
-#            s3 = boto3.client('s3', aws_access_key_id='your-access-key', aws_secret_access_key='your-secret-key')
-#            s3.upload_file(photo_path, 'your-bucket-name', 'your-object-key')
-#
-#            # Task 2: Send a Request to the `yolo5` Service for Prediction
-#            # Replace 'yolo5-service-url' with the actual URL or endpoint of the `yolo5` service.
-#            yolo5_service_url = 'yolo5-service-url'
-#            with open(photo_path, 'rb') as photo_file:
-#               files = {'photo': (photo_path, photo_file)}
-#                response = requests.post(yolo5_service_url, files=files)
-#
-#            # Task 3: Send Results to the Telegram End-User
-#            if response.status_code == 200:
-#                detected_objects = response.json()  # Assuming the response contains detected object data.
-#                # Process and format the detected_objects as needed.
-#
-#               # Send the formatted results back to the Telegram end-user.
-#                self.send_text(msg['chat']['id'], f'Detected Objects: {detected_objects}')
-#            else:
-#                self.send_text(msg['chat']['id'], 'Object detection service error.')
-#
-#        # Example usage:
-#        # object_detection_bot = ObjectDetectionBot(token='your-bot-token', telegram_chat_url='your-telegram-chat-url')
-#
-#            # TODO upload the photo to S3
-#            # TODO send a request to the `yolo5` service for prediction
-#            # TODO send results to the Telegram end-user
+    def shutdown(self):
+        self.scheduler.shutdown(wait=True)
+        self.detection_client.close()
@@ -0,0 +1,182 @@
+"""
+Client of the yolo5 object detection service.
+
+One pooled HTTP session is shared by all the bot's threads. Requests are bounded (at most
+`max_concurrency` in flight, callers wait up to `acquire_timeout` for a slot), time out, and are
+retried on connection errors and 502/503/504 with exponential backoff, never after a read timeout.
+A circuit breaker stops calling the service after repeated failures and lets a single trial request
+through once `reset_timeout` passed, so an outage fails photos fast instead of piling up waiting threads.
+"""
+from collections import Counter
+import threading
+import time
+from loguru import logger
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_ACQUIRE_TIMEOUT = 30
+# (connect, read) seconds
+DEFAULT_TIMEOUT = (3.05, 30)
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+RETRY_STATUSES = (502, 503, 504)
+
+
+class DetectionUnavailable(Exception):
+    """
+    The yolo5 service cannot take the request: the circuit is open or no slot freed up in time
+    """
+
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        'closed' (calls go through), 'open' (calls fail fast) or 'half_open' (one trial call allowed)
+        """
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half_open'
+
+    def allow(self):
+        """
+        Whether a call may go through now. In the half open state only the first caller is let through,
+        its outcome closes or re-opens the circuit.
+        """
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f'Circuit opened after {self.failures} consecutive failures')
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+def make_session(pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    """
+    HTTP session keeping up to `pool_size` connections alive, retrying connection errors and
+    502/503/504 responses (honouring Retry-After), but not read timeouts
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    # Only requests yolo5 did not run are repeated. After a read timeout the inference may still be
+    # running there (its prediction cache is filled once it completes), a retry would run it again
+    retry = Retry(total=retries, read=0, backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+                  allowed_methods=None, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def make_s3_client(max_pool_connections=DEFAULT_POOL_SIZE, **kwargs):
+    """
+    S3 client with a connection pool sized for the bot's concurrency, keep-alive and adaptive retries
+    """
+    import boto3
+    from botocore.config import Config
+
+    config = Config(max_pool_connections=max_pool_connections,
+                    tcp_keepalive=True,
+                    retries={'max_attempts': 5, 'mode': 'adaptive'})
+    return boto3.client('s3', config=config, **kwargs)
+
+
+class DetectionClient:
+
+    def __init__(self, url, session=None, timeout=DEFAULT_TIMEOUT, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT, breaker=None):
+        self.url = url.rstrip('/')
+        self.session = session or make_session(pool_size=max_concurrency)
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def predict(self, img_name):
+        """
+        Asks yolo5 to detect the objects of the S3 object `img_name`, returns its prediction summary.
+        Raises DetectionUnavailable without calling the service when the circuit is open or all
+        slots stayed busy for `acquire_timeout`, and requests' errors when the call failed.
+        """
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise DetectionUnavailable(f'No free slot to the detection service in {self.acquire_timeout} s')
+        try:
+            if not self.breaker.allow():
+                raise DetectionUnavailable('Detection service circuit is open')
+            with self._lock:
+                self._in_flight += 1
+            try:
+                response = self.session.post(f'{self.url}/predict', params={'imgName': img_name},
+                                             timeout=self.timeout)
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+
+            # A 4xx is about this request (e.g. a missing image), the service itself answered fine
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            response.raise_for_status()
+            return response.json()
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self.session.close()
+
+
+def format_prediction(prediction):
+    """
+    Telegram text of a prediction summary: the detected classes with their counts, most frequent first
+    """
+    counts = Counter(label['class'] for label in prediction.get('labels', []))
+    if not counts:
+        return 'No objects detected.'
+    return 'Detected objects:\n' + '\n'.join(f'{name}: {count}' for name, count in counts.most_common())
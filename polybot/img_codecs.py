@@ -0,0 +1,153 @@
+"""
+Codecs turning image files into grayscale pixel matrices and back.
+
+PILCodec (the default) decodes JPEG and PNG straight to 8-bit luma (for JPEG inside the decoder, which
+can also scale by 1/2 to 1/8 while decoding) and encodes 8-bit grayscale directly.
+MatplotlibCodec is the former imread / imsave path, which renders through a colormap to RGBA;
+it is kept for comparison in the benchmark.
+
+With a `max_dimension` cap, images whose longer side exceeds it are decoded straight to (about)
+that size, instead of being decoded in full and shrunk afterwards.
+"""
+import io
+import os
+import numpy as np
+from PIL import Image
+
+DEFAULT_CODEC = 'pil'
+
+
+def pil_format(image_format):
+    """
+    PIL format name of a file extension or format name ('jpg', 'jpeg', 'png', ...), PNG when unknown
+    """
+    extension = '.' + image_format.lower().lstrip('.')
+    return Image.registered_extensions().get(extension, 'PNG')
+
+
+def to_levels(pixels):
+    """
+    Scales a pixel matrix to 8-bit gray levels over its min..max range, as matplotlib's imsave does
+    """
+    pixels = np.asarray(pixels)
+    if pixels.size == 0:
+        return np.zeros(pixels.shape, dtype=np.uint8)
+
+    low, high = pixels.min(), pixels.max()
+    if high <= low:
+        return np.zeros(pixels.shape, dtype=np.uint8)
+    if low == 0 and high == 255 and pixels.dtype == np.uint8:
+        return np.ascontiguousarray(pixels)
+
+    levels = (pixels - np.float32(low)) * np.float32(256 / (high - low))
+    return np.clip(levels, 0, 255, out=levels).astype(np.uint8)
+
+
+def capped_size(size, max_dimension):
+    """
+    `size` (width, height) scaled down so its longer side is at most `max_dimension`
+    """
+    width, height = size
+    if not max_dimension or max(width, height) <= max_dimension:
+        return size
+    scale = max_dimension / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class UnsupportedFormat(ValueError):
+    pass
+
+
+def open_gray(source, max_dimension=None, formats=None):
+    """
+    Decodes `source` (a path or file object) to a PIL grayscale ('L') image, capped to `max_dimension`.
+    With `formats` (PIL format names), other formats raise UnsupportedFormat before anything is decoded.
+    """
+    with Image.open(source) as image:
+        if formats is not None and image.format not in formats:
+            raise UnsupportedFormat(f'{image.format} images are not supported here, only {", ".join(formats)}')
+        target = capped_size(image.size, max_dimension)
+        # JPEG: luma only, and DCT scaling to the smallest 1/2..1/8 size still covering the target
+        image.draft('L', target)
+        gray = image.convert('L')
+
+    if gray.size != target:
+        # What the decoder could not scale (other formats, or the remainder of the JPEG scale)
+        gray = gray.resize(target, Image.Resampling.BOX, reducing_gap=2.0)
+    return gray
+
+
+class PILCodec:
+
+    def decode(self, source, image_format=None, max_dimension=None):
+        """
+        Decodes `source` (a path or file object) to a (writable) 2D uint8 luma matrix
+        """
+        # np.asarray would return a read-only view of the PIL image, which uint8 Imgs use as their buffer
+        return np.array(open_gray(source, max_dimension))
+
+    def encode(self, pixels, image_format):
+        buffer = io.BytesIO()
+        self.save(pixels, buffer, image_format)
+        return buffer.getvalue()
+
+    def save(self, pixels, target, image_format=None):
+        """
+        Writes `pixels` as an 8-bit grayscale image to `target` (a path or file object).
+        Without `image_format` the format follows the path's extension.
+        """
+        Image.fromarray(to_levels(pixels), 'L').save(target, format=image_format and pil_format(image_format))
+
+
+class MatplotlibCodec:
+
+    def decode(self, source, image_format=None, max_dimension=None):
+        """
+        Decodes `source` with matplotlib's imread: RGB(A) or 2D, 0..255 for JPEG but 0..1 floats for PNG
+        """
+        from matplotlib.image import imread
+
+        pixels = imread(source, format=image_format)
+        height, width = pixels.shape[:2]
+        if max_dimension and max(height, width) > max_dimension:
+            # Decoded in full, then shrunk: the cost the PIL codec avoids
+            step = -(-max(height, width) // max_dimension)
+            pixels = pixels[::step, ::step]
+        return pixels
+
+    def encode(self, pixels, image_format):
+        buffer = io.BytesIO()
+        self.save(pixels, buffer, image_format)
+        return buffer.getvalue()
+
+    def save(self, pixels, target, image_format=None):
+        from matplotlib.image import imsave
+
+        imsave(target, pixels, cmap='gray', format=image_format)
+
+
+CODECS = {
+    'pil': PILCodec(),
+    'matplotlib': MatplotlibCodec(),
+}
+
+
+def register_codec(name, codec):
+    """
+    Makes `codec` (an object with decode / encode / save methods like PILCodec's) available as `name`
+    """
+    CODECS[name] = codec
+
+
+def codec_name(name=None):
+    """
+    `name`, by default the name of the codec configured by IMAGE_CODEC (or 'pil')
+    """
+    return name or os.environ.get('IMAGE_CODEC', DEFAULT_CODEC)
+
+
+def get_codec(name=None):
+    """
+    The codec registered as `name`, by default the one named by IMAGE_CODEC (or 'pil')
+    """
+    return CODECS[codec_name(name)]
@@ -0,0 +1,221 @@
+"""
+Convolution engine behind the Img filters.
+
+convolve() runs a 2D kernel over a pixel matrix with one of three strategies:
+
+- 'separable': a rank-1 kernel (box, Gaussian, Sobel, ...) is split into a column and a row vector
+  and applied as two 1-D passes, kh + kw taps per pixel instead of kh * kw
+- 'direct': one shifted multiply-add over the whole image per kernel tap, cheapest for small kernels
+- 'fft': a product in the frequency domain, whose cost hardly depends on the kernel size
+
+Unless a strategy is given, the cheapest one is picked from a cost model whose per-tap and per-FFT
+constants are measured once per process (see calibrate()).
+"""
+import math
+import time
+import numpy as np
+
+STRATEGIES = ('separable', 'direct', 'fft')
+
+# Relative size of the second singular value below which a kernel counts as separable
+SEPARABLE_TOLERANCE = 1e-6
+CALIBRATION_SIZE = 256
+
+# Flipped by the convolution: out[i, j] = p[i, j] - p[i, j + 1], the contour filter once made absolute
+CONTOUR_KERNEL = np.array([[-1, 1]], dtype=np.float32)
+SOBEL_X = np.array([[1, 0, -1], [2, 0, -2], [1, 0, -1]], dtype=np.float32)
+SOBEL_Y = np.ascontiguousarray(SOBEL_X.T)
+# Negative Laplacian: added to the identity (scaled by the amount) it sharpens
+LAPLACIAN = np.array([[0, -1, 0], [-1, 4, -1], [0, -1, 0]], dtype=np.float32)
+
+_costs = {}
+
+
+def box_kernel(size):
+    """
+    Average of a `size x size` window, what Img.blur computes
+    """
+    return np.full((size, size), 1 / size ** 2, dtype=np.float32)
+
+
+def gaussian_kernel(sigma, radius=None):
+    """
+    Normalized 2D Gaussian of standard deviation `sigma`, truncated at `radius` (3 sigma by default)
+    """
+    radius = math.ceil(3 * sigma) if radius is None else radius
+    offsets = np.arange(-radius, radius + 1, dtype=np.float64)
+    weights = np.exp(-offsets ** 2 / (2 * sigma ** 2))
+    weights /= weights.sum()
+    return np.outer(weights, weights).astype(np.float32)
+
+
+def sharpen_kernel(amount=1.0):
+    kernel = LAPLACIAN * np.float32(amount)
+    kernel[1, 1] += 1
+    return kernel
+
+
+def separable_factors(kernel):
+    """
+    (column, row) vectors whose outer product is `kernel`, or None if it is not separable
+    """
+    u, s, vt = np.linalg.svd(np.asarray(kernel, dtype=np.float64))
+    if len(s) > 1 and s[1] > SEPARABLE_TOLERANCE * s[0]:
+        return None
+    scale = math.sqrt(s[0])
+    return (u[:, 0] * scale).astype(np.float32), (vt[0] * scale).astype(np.float32)
+
+
+def valid_shape(shape, kernel_shape):
+    return max(shape[0] - kernel_shape[0] + 1, 0), max(shape[1] - kernel_shape[1] + 1, 0)
+
+
+def pad_same(pixels, kernel_shape):
+    """
+    Pads `pixels` (mirroring the border) so a valid convolution with `kernel_shape` keeps its size
+    """
+    kh, kw = kernel_shape
+    padding = ((kh - 1) // 2, kh // 2), ((kw - 1) // 2, kw // 2)
+    mode = 'reflect' if min(pixels.shape) > max(kh, kw) // 2 else 'edge'
+    return np.pad(pixels, padding, mode=mode)
+
+
+def _fast_length(n):
+    """
+    Smallest 2^a * 3^b * 5^c >= n, the sizes FFTs are fast for
+    """
+    best = 1 << max(n - 1, 0).bit_length()
+    power_of_5 = 1
+    while power_of_5 < best:
+        odd_part = power_of_5
+        while odd_part < best:
+            length = odd_part
+            while length < n:
+                length *= 2
+            best = min(best, length)
+            odd_part *= 3
+        power_of_5 *= 5
+    return best
+
+
+def _direct(pixels, kernel):
+    kh, kw = kernel.shape
+    oh, ow = valid_shape(pixels.shape, kernel.shape)
+    flipped = kernel[::-1, ::-1]
+    out = np.zeros((oh, ow), dtype=np.float32)
+    tap = np.empty_like(out)
+
+    for a in range(kh):
+        for b in range(kw):
+            if flipped[a, b]:
+                np.multiply(pixels[a:a + oh, b:b + ow], flipped[a, b], out=tap, dtype=np.float32)
+                out += tap
+    return out
+
+
+def _separable(pixels, kernel):
+    column, row = separable_factors(kernel)
+    # Two 1-D passes: down the columns, then along the rows of the partial result
+    partial = _direct(pixels, column[:, None])
+    return _direct(partial, row[None, :])
+
+
+def _fft(pixels, kernel):
+    height, width = pixels.shape
+    kh, kw = kernel.shape
+    # The circular wrap-around only touches the first kh - 1 rows (kw - 1 columns), which the
+    # valid result drops, so the transform needs no padding beyond the image
+    shape = _fast_length(height), _fast_length(width)
+    spectrum = np.fft.rfft2(pixels, s=shape)
+    spectrum *= np.fft.rfft2(kernel, s=shape)
+    full = np.fft.irfft2(spectrum, s=shape)
+    return full[kh - 1:height, kw - 1:width].astype(np.float32)
+
+
+_STRATEGY_FUNCTIONS = {'separable': _separable, 'direct': _direct, 'fft': _fft}
+
+
+def calibrate(size=CALIBRATION_SIZE, repeats=3):
+    """
+    Measures the cost constants of the model: seconds per kernel tap per output pixel (direct and
+    separable passes) and per N log2 N of an FFT convolution over N pixels
+    """
+    pixels = np.random.default_rng(0).random((size, size), dtype=np.float32)
+    kernel = box_kernel(3)
+
+    def best_time(function):
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            function(pixels, kernel)
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    out_pixels = math.prod(valid_shape(pixels.shape, kernel.shape))
+    fft_pixels = _fast_length(size) ** 2
+    _costs['tap'] = best_time(_direct) / (kernel.size * out_pixels)
+    _costs['fft'] = best_time(_fft) / (fft_pixels * math.log2(fft_pixels))
+    return dict(_costs)
+
+
+def estimate_cost(strategy, shape, kernel):
+    """
+    Estimated seconds of convolving a `shape` image with `kernel` using `strategy` (inf if not applicable)
+    """
+    if not _costs:
+        calibrate()
+
+    kh, kw = kernel.shape
+    oh, ow = valid_shape(shape, kernel.shape)
+    if strategy == 'direct':
+        return _costs['tap'] * np.count_nonzero(kernel) * oh * ow
+    if strategy == 'separable':
+        if min(kh, kw) == 1 or separable_factors(kernel) is None:
+            return float('inf')
+        return _costs['tap'] * (kh * oh * shape[1] + kw * oh * ow)
+    if strategy == 'fft':
+        fft_pixels = _fast_length(shape[0]) * _fast_length(shape[1])
+        return _costs['fft'] * fft_pixels * math.log2(max(fft_pixels, 2))
+    raise ValueError(f'Unknown convolution strategy {strategy!r}, expected one of {STRATEGIES}')
+
+
+def choose_strategy(shape, kernel):
+    kernel = np.asarray(kernel, dtype=np.float32)
+    return min(STRATEGIES, key=lambda strategy: estimate_cost(strategy, shape, kernel))
+
+
+def convolve(pixels, kernel, mode='valid', strategy=None):
+    """
+    Convolves a 2D pixel matrix with `kernel`. 'valid' keeps only the windows fully inside the image,
+    'same' mirrors the border so the result has the image's size.
+    """
+    kernel = np.asarray(kernel, dtype=np.float32)
+    pixels = np.asarray(pixels)
+    if mode == 'same':
+        pixels = pad_same(pixels, kernel.shape)
+    elif mode != 'valid':
+        raise ValueError(f"Unknown mode {mode!r}, expected 'valid' or 'same'")
+
+    if 0 in valid_shape(pixels.shape, kernel.shape):
+        return np.zeros(valid_shape(pixels.shape, kernel.shape), dtype=np.float32)
+
+    strategy = strategy or choose_strategy(pixels.shape, kernel)
+    if strategy == 'separable' and separable_factors(kernel) is None:
+        raise ValueError('Kernel is not separable')
+    return _STRATEGY_FUNCTIONS[strategy](pixels, kernel)
+
+
+def convolve_band(pixels, kernel, strategy):
+    """
+    Valid convolution of a row band (see img_parallel.map_bands)
+    """
+    return convolve(pixels, kernel, 'valid', strategy)
+
+
+def sobel_band(pixels, strategy):
+    """
+    Sobel gradient magnitude of the valid 3x3 windows of a row band
+    """
+    gradient_x = convolve(pixels, SOBEL_X, 'valid', strategy)
+    gradient_y = convolve(pixels, SOBEL_Y, 'valid', strategy)
+    return np.hypot(gradient_x, gradient_y, out=gradient_x)
@@ -0,0 +1,106 @@
+"""
+Multi-core execution of row-band image kernels.
+
+The source pixels are copied once into a shared memory block, every worker process attaches to it
+and writes its band of the result into a second shared block, so no pixel data is pickled between
+processes. Bands overlap by `halo` rows for neighbourhood kernels (e.g. blur).
+
+Workers are started by a forkserver rather than forked from the bot: a fork copies the state of the
+bot's threads (held locks, open connections) into every worker. The pools are kept for the life of
+the process, `shutdown_pools` stops them.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import math
+import multiprocessing
+import threading
+import sys
+import numpy as np
+
+# Below this many output pixels the pool overhead outweighs the work, and bands run in-process
+PARALLEL_MIN_PIXELS = 256 * 256
+
+START_METHOD = 'forkserver'
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(workers):
+    """
+    Process pools are shared by worker count, until `shutdown_pools`
+    """
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ProcessPoolExecutor(max_workers=workers,
+                                                  mp_context=multiprocessing.get_context(START_METHOD))
+        return _pools[workers]
+
+
+def shutdown_pools(wait=True):
+    """
+    Stops the worker processes of all pools. A later `map_bands` starts new ones.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=wait)
+
+
+def _attach(name):
+    # The creating process owns (and unlinks) the block. Pool workers share its resource tracker,
+    # where registering the same name again is a no-op
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    return SharedMemory(name=name)
+
+
+def _run_band(kernel, args, source, target, start, stop, halo):
+    source_shm = _attach(source[0])
+    target_shm = _attach(target[0])
+    try:
+        pixels = np.ndarray(source[1], dtype=source[2], buffer=source_shm.buf)
+        result = np.ndarray(target[1], dtype=target[2], buffer=target_shm.buf)
+        result[start:stop] = kernel(pixels[start:stop + halo], *args)
+        del pixels, result
+    finally:
+        source_shm.close()
+        target_shm.close()
+
+
+def _shared_array(shape, dtype):
+    shm = SharedMemory(create=True, size=max(math.prod(shape) * np.dtype(dtype).itemsize, 1))
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def map_bands(pixels, out_shape, halo, kernel, *args, workers=1, dtype=np.float32):
+    """
+    Computes an `out_shape` result where output rows [start, stop) are
+    kernel(pixels[start:stop + halo], *args), split into `workers` row bands run in parallel.
+    `kernel` must be a module-level function so worker processes can import it.
+    """
+    out_rows = out_shape[0]
+    if workers <= 1 or math.prod(out_shape) < PARALLEL_MIN_PIXELS:
+        return np.ascontiguousarray(kernel(pixels, *args), dtype=dtype)
+
+    source_shm, source = _shared_array(pixels.shape, pixels.dtype)
+    target_shm, target = _shared_array(out_shape, dtype)
+    try:
+        source[...] = pixels
+
+        band_rows = math.ceil(out_rows / workers)
+        source_spec = (source_shm.name, pixels.shape, pixels.dtype.str)
+        target_spec = (target_shm.name, tuple(out_shape), np.dtype(dtype).str)
+        futures = [get_pool(workers).submit(_run_band, kernel, args, source_spec, target_spec,
+                                            start, min(start + band_rows, out_rows), halo)
+                   for start in range(0, out_rows, band_rows)]
+        for future in futures:
+            future.result()
+
+        return target.copy()
+    finally:
+        del source, target
+        for shm in (source_shm, target_shm):
+            shm.close()
+            shm.unlink()
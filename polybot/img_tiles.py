@@ -0,0 +1,159 @@
+"""
+Tiled processing for images too large to hold in memory.
+
+The decoded grayscale image is kept in a scratch file, and filters run over it band by band (with
+the halo rows that neighbourhood filters need), writing each output band straight to another scratch
+file. Every band is accessed through a memory mapping of its own rows, dropped once the band is done,
+so the filters keep only a few bands of `tile_rows` rows resident.
+
+Two steps still hold one byte per pixel: the JPEG decode (PIL decodes the luma plane whole) and the
+8-bit levels the encoder reads. That is the peak, a fraction of the RGB decode and float32 buffers
+of Img. Only JPEG is accepted, other formats would be decoded to full RGB first. encode() returns the
+compressed output in memory, save_img() writes it to a file.
+"""
+from pathlib import Path
+import io
+import itertools
+import tempfile
+import numpy as np
+from PIL import Image
+from polybot.img_codecs import open_gray
+from polybot.img_proc import blur_band, contour_band
+
+DEFAULT_TILE_ROWS = 256
+# Formats decoded straight to luma (MPO is the multi-picture JPEG some cameras write)
+TILED_FORMATS = ('JPEG', 'MPO')
+
+
+class TiledImg:
+
+    def __init__(self, path, tile_rows=DEFAULT_TILE_ROWS, scratch_dir=None, encoded=None, max_dimension=None):
+        """
+        Decodes the image at `path` (or the image file bytes `encoded`, then `path` only names the output)
+        to grayscale into a memory-mapped scratch buffer, scaled down to `max_dimension` if given.
+        Scratch files live in a temporary directory under `scratch_dir` and are removed by close().
+        """
+        self.path = Path(path)
+        self.tile_rows = tile_rows
+        self._scratch = tempfile.TemporaryDirectory(prefix='polybot-tiles-', dir=scratch_dir)
+        self._buffer_ids = itertools.count()
+        self.pixels = self._decode(self.path if encoded is None else io.BytesIO(encoded), max_dimension)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._release(self.pixels)
+        self._scratch.cleanup()
+
+    def _new_buffer(self, shape, dtype=np.float32):
+        buffer_path = Path(self._scratch.name) / f'buffer_{next(self._buffer_ids)}.dat'
+        return np.memmap(buffer_path, dtype=dtype, mode='w+', shape=shape)
+
+    @staticmethod
+    def _rows(buffer, start, stop):
+        """
+        Rows `start` to `stop` of a scratch buffer, through a mapping of their own. Its pages stop
+        counting as resident memory once the returned array is dropped.
+        """
+        height, width = buffer.shape
+        stop = min(stop, height)
+        if stop <= start or not width:
+            return np.empty((max(stop - start, 0), width), dtype=buffer.dtype)
+        return np.memmap(buffer.filename, dtype=buffer.dtype, mode='r+',
+                         offset=start * width * buffer.dtype.itemsize, shape=(stop - start, width))
+
+    @staticmethod
+    def _release(buffer):
+        # Unlinking is enough: the mapping (and its pages) go away with the last view of the buffer
+        Path(buffer.filename).unlink(missing_ok=True)
+
+    def _decode(self, source, max_dimension=None):
+        # The JPEG decoder produces luma directly, so no full RGB buffer is ever built
+        gray = open_gray(source, max_dimension, formats=TILED_FORMATS)
+
+        width, height = gray.size
+        pixels = self._new_buffer((height, width))
+        for start in range(0, height, self.tile_rows):
+            stop = min(start + self.tile_rows, height)
+            self._rows(pixels, start, stop)[:] = np.asarray(gray.crop((0, start, width, stop)), dtype=np.float32)
+
+        gray.close()
+        return pixels
+
+    def _map_bands(self, out_shape, halo, kernel):
+        """
+        Fills a new buffer of `out_shape`, one band of `tile_rows` output rows at a time.
+        `kernel` gets the matching input rows plus `halo` extra rows below them.
+        """
+        result = self._new_buffer(out_shape)
+
+        for start in range(0, out_shape[0], self.tile_rows):
+            stop = min(start + self.tile_rows, out_shape[0])
+            self._rows(result, start, stop)[:] = kernel(self._rows(self.pixels, start, stop + halo))
+
+        self._release(self.pixels)
+        self.pixels = result
+
+    def blur(self, blur_level=16):
+        height, width = self.pixels.shape
+        out_shape = (max(height - blur_level + 1, 0), max(width - blur_level + 1, 0))
+
+        # Same fixed-point summed-area table as Img.blur, so each band is bit-identical to the whole-image result
+        self._map_bands(out_shape, blur_level - 1, lambda band: blur_band(band, blur_level))
+
+    def contour(self):
+        height, width = self.pixels.shape
+        self._map_bands((height, max(width - 1, 0)), 0, contour_band)
+
+    def salt_n_pepper(self, amount=0.05, seed=None):
+        rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+
+        for start in range(0, self.pixels.shape[0], self.tile_rows):
+            band = self._rows(self.pixels, start, start + self.tile_rows)
+            first_draw, second_draw = rng.random((2,) + band.shape, dtype=np.float32)
+            salt = first_draw < amount
+            band[salt] = 0
+            band[~salt & (second_draw < amount)] = 255
+
+    def save_img(self):
+        """
+        Encodes the result next to the source image, like Img.save_img.
+        """
+        new_path = self.path.with_name(self.path.stem + '_filtered' + self.path.suffix)
+        self._encode(new_path)
+        return new_path
+
+    def encode(self):
+        """
+        Encodes the result like save_img does, but into bytes instead of a file
+        """
+        buffer = io.BytesIO()
+        self._encode(buffer, Image.registered_extensions().get(self.path.suffix.lower(), 'PNG'))
+        return buffer.getvalue()
+
+    def _encode(self, target, image_format=None):
+        """
+        Gray levels are scaled from the image min..max range, as matplotlib's imsave does
+        """
+        height, width = self.pixels.shape
+
+        starts = range(0, height, self.tile_rows)
+        ranges = [(band.min(), band.max()) for band in
+                  (self._rows(self.pixels, start, start + self.tile_rows) for start in starts) if band.size]
+        low = min((band_low for band_low, _ in ranges), default=0)
+        high = max((band_high for _, band_high in ranges), default=0)
+        scale = 256 / (high - low) if high > low else 0
+
+        levels = self._new_buffer((height, width), dtype=np.uint8)
+        for start in starts:
+            band = self._rows(self.pixels, start, start + self.tile_rows)
+            self._rows(levels, start, start + self.tile_rows)[:] = np.clip((band - low) * scale, 0, 255)
+
+        # The encoder reads rows straight from the memory-mapped levels buffer (one byte per pixel)
+        with Image.frombuffer('L', (width, height), levels, 'raw', 'L', 0, 1) as image:
+            image.save(target, format=image_format)
+        self._release(levels)
@@ -0,0 +1,110 @@
+"""
+Job scheduler for the bots: a bounded queue feeding a pool of worker threads.
+
+Jobs are submitted under a key (the Telegram chat id). Jobs with the same key run one at a time
+in submission order, so a user gets results in the order the photos were sent, while jobs of
+different keys run in parallel.
+"""
+from collections import deque
+import threading
+from loguru import logger
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_QUEUED = 100
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobScheduler:
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_queued=DEFAULT_MAX_QUEUED):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._queues = {}
+        self._ready = deque()
+        self._running = set()
+        self._pending = 0
+        self._shutdown = False
+        self._condition = threading.Condition()
+        self._threads = [threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, job):
+        """
+        Queues `job` (a callable) behind the other jobs of `key`.
+        Returns 0 when an idle worker picks the job up right away, otherwise its position in the
+        queue: the jobs waiting to start beyond the idle workers, this one included.
+        Raises QueueFull when `max_queued` jobs are already waiting.
+        """
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError('Scheduler is shut down')
+            if self._pending >= self.max_queued:
+                raise QueueFull(f'{self._pending} jobs already queued')
+
+            queue = self._queues.setdefault(key, deque())
+            queue.append(job)
+            # A key is ready when it has work and none of its jobs is running
+            if len(queue) == 1 and key not in self._running:
+                self._ready.append(key)
+
+            self._pending += 1
+            self._condition.notify_all()
+
+            idle_workers = self.workers - len(self._running)
+            if key not in self._running and len(queue) == 1 and len(self._ready) <= idle_workers:
+                return 0
+            return max(self._pending - idle_workers, 1)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._ready and not self._shutdown:
+                    self._condition.wait()
+                if not self._ready:
+                    return
+
+                key = self._ready.popleft()
+                job = self._queues[key].popleft()
+                self._running.add(key)
+                self._pending -= 1
+
+            try:
+                job()
+            except Exception:
+                logger.exception(f'Job for {key} failed')
+            finally:
+                with self._condition:
+                    self._running.discard(key)
+                    if self._queues[key]:
+                        self._ready.append(key)
+                    else:
+                        del self._queues[key]
+                    self._condition.notify_all()
+
+    def join(self, timeout=None):
+        """
+        Waits until every submitted job has finished. Returns False on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._running, timeout)
+
+    def shutdown(self, wait=True):
+        """
+        Stops accepting jobs. Workers drain the queued jobs before exiting.
+        """
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def stats(self):
+        with self._condition:
+            return {'workers': self.workers, 'queued': self._pending, 'running': len(self._running)}
@@ -0,0 +1,84 @@
+"""
+Aggregation of Telegram media groups (albums).
+
+Telegram delivers each photo of an album as a separate update, sharing a `media_group_id`,
+with no marker for the last one. Messages are buffered per group until no new part arrived for
+`timeout` seconds, then the whole group is handed over at once.
+"""
+import threading
+from loguru import logger
+
+DEFAULT_TIMEOUT = 1.0
+DEFAULT_MAX_GROUPS = 100
+# Telegram albums hold at most 10 items
+DEFAULT_MAX_PARTS = 10
+
+
+class MediaGroupAggregator:
+
+    def __init__(self, on_complete, timeout=DEFAULT_TIMEOUT, max_groups=DEFAULT_MAX_GROUPS,
+                 max_parts=DEFAULT_MAX_PARTS):
+        """
+        `on_complete` is called with the messages of each complete group, ordered by message_id.
+        At most `max_groups` incomplete groups (of up to `max_parts` messages) are buffered.
+        """
+        self.on_complete = on_complete
+        self.timeout = timeout
+        self.max_groups = max_groups
+        self.max_parts = max_parts
+        self._groups = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def add(self, msg):
+        """
+        Buffers `msg` with the other parts of its media group.
+        Returns False (and drops the message) when too many groups are already incomplete.
+        """
+        group_id = msg['media_group_id']
+
+        with self._lock:
+            if group_id not in self._groups and len(self._groups) >= self.max_groups:
+                logger.warning(f'{len(self._groups)} media groups pending, dropping group {group_id}')
+                return False
+
+            parts = self._groups.setdefault(group_id, [])
+            if len(parts) < self.max_parts:
+                parts.append(msg)
+
+            # Every new part restarts the wait for the next one
+            if group_id in self._timers:
+                self._timers[group_id].cancel()
+            timer = threading.Timer(self.timeout, self._complete, args=(group_id,))
+            timer.daemon = True
+            self._timers[group_id] = timer
+            timer.start()
+
+        return True
+
+    def _complete(self, group_id):
+        with self._lock:
+            parts = self._groups.pop(group_id, None)
+            self._timers.pop(group_id, None)
+
+        if parts:
+            try:
+                self.on_complete(sorted(parts, key=lambda part: part.get('message_id', 0)))
+            except Exception:
+                logger.exception(f'Failed handling media group {group_id}')
+
+    def flush(self):
+        """
+        Completes all pending groups right away (e.g. on shutdown)
+        """
+        with self._lock:
+            group_ids = list(self._groups)
+            for timer in self._timers.values():
+                timer.cancel()
+
+        for group_id in group_ids:
+            self._complete(group_id)
+
+    def pending(self):
+        with self._lock:
+            return len(self._groups)
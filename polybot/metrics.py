@@ -0,0 +1,213 @@
+"""
+Hot-path instrumentation: per-stage timing spans, latency histograms, queue gauges and counters,
+exposed in the Prometheus text format, plus an optional sampling profiler toggled at runtime.
+
+This module is shared by both services: the yolo5 image gets a copy of it at build time (see yolo5/Dockerfile).
+
+Stages are timed with
+
+    with metrics.span('download', request_id):
+        ...
+
+which records the duration in the stage's histogram and in the trace of `request_id`
+(a chat/message or prediction id), so the slow stage of a slow request can be looked up.
+"""
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+import bisect
+import hmac
+import os
+import sys
+import threading
+import time
+import traceback
+from loguru import logger
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Number of recent requests whose traces are kept
+DEFAULT_REMEMBERED_TRACES = 1000
+DEFAULT_PROFILER_INTERVAL = 0.01
+# Distinct stacks the profiler counts, samples of further stacks are only counted as dropped
+DEFAULT_MAX_STACKS = 10000
+
+
+class Histogram:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Estimate of the `q` quantile: the upper bound of the bucket it falls in
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return float('inf') if self.counts[-1] else 0.0
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads every `interval` seconds, counting each (collapsed) stack
+    """
+
+    def __init__(self, interval=DEFAULT_PROFILER_INTERVAL, max_stacks=DEFAULT_MAX_STACKS):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.samples = Counter()
+        self.dropped = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if not self.running:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    stack = ';'.join(f'{entry.name} ({entry.filename}:{entry.lineno})'
+                                     for entry in traceback.extract_stack(frame))
+                    if stack in self.samples or len(self.samples) < self.max_stacks:
+                        self.samples[stack] += 1
+                    else:
+                        self.dropped += 1
+
+    def collapsed(self, top=None):
+        """
+        Sampled stacks in the collapsed format of flame graph tools, most frequent first
+        """
+        return '\n'.join(f'{stack} {count}' for stack, count in self.samples.most_common(top))
+
+
+class Metrics:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, remembered_traces=DEFAULT_REMEMBERED_TRACES, debug_token=None):
+        """
+        Traces and the profiler are only served to requests presenting `debug_token`
+        (METRICS_DEBUG_TOKEN by default), and to none without one
+        """
+        self.buckets = buckets
+        self.remembered_traces = remembered_traces
+        self.debug_token = debug_token if debug_token is not None else os.environ.get('METRICS_DEBUG_TOKEN')
+        self.profiler = None
+        self._histograms = {}
+        self._values = {}
+        self._traces = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage, request_id=None):
+        """
+        Times the block as `stage` of the request `request_id` (even when it raises)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, request_id)
+
+    def observe(self, stage, seconds, request_id=None):
+        with self._lock:
+            self._histograms.setdefault(stage, Histogram(self.buckets)).observe(seconds)
+            if request_id is not None:
+                self._traces.setdefault(str(request_id), []).append((stage, seconds))
+                self._traces.move_to_end(str(request_id))
+                while len(self._traces) > self.remembered_traces:
+                    self._traces.popitem(last=False)
+
+        logger.debug(f'{request_id}: {stage} took {seconds * 1000:.1f} ms')
+
+    def gauge(self, name, read):
+        """
+        Registers a gauge, `read()` returns its current value (e.g. a queue depth)
+        """
+        self._values[name] = ('gauge', read)
+
+    def counter(self, name, read):
+        """
+        Registers a counter, `read()` returns its running total (e.g. cache hits). Prometheus names of
+        counters end in _total.
+        """
+        self._values[name] = ('counter', read)
+
+    def trace(self, request_id):
+        """
+        The (stage, seconds) spans of a recent request, in order
+        """
+        with self._lock:
+            return list(self._traces.get(str(request_id), []))
+
+    def histogram(self, stage):
+        with self._lock:
+            return self._histograms.get(stage)
+
+    def allows_debug(self, token):
+        return bool(self.debug_token) and token is not None and hmac.compare_digest(token, self.debug_token)
+
+    def start_profiler(self, interval=DEFAULT_PROFILER_INTERVAL):
+        """
+        Starts (or restarts, with a new interval) sampling all threads' stacks
+        """
+        self.stop_profiler()
+        self.profiler = SamplingProfiler(interval)
+        self.profiler.start()
+
+    def stop_profiler(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        lines = ['# TYPE stage_latency_seconds histogram']
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'stage_latency_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'stage_latency_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'stage_latency_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+        for name, (kind, read) in sorted(self._values.items()):
+            try:
+                value = read()
+            except Exception:
+                logger.exception(f'Reading {kind} {name} failed')
+                continue
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+# The process-wide registry
+metrics = Metrics()
@@ -0,0 +1,113 @@
+"""
+Two-tier (memory, then disk) LRU cache of encoded filter results.
+
+Entries are keyed by the source image identity (Telegram's `file_unique_id`, or a hash of the
+image bytes) plus the operation and its parameters, and both tiers are bounded by total size.
+Values are encoded images (bytes), or lists of them (e.g. segments), which are kept in memory only.
+"""
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import os
+import threading
+
+DEFAULT_MEMORY_BYTES = 64 * 2 ** 20
+DEFAULT_DISK_BYTES = 512 * 2 ** 20
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _size(value):
+    return len(value) if isinstance(value, bytes) else sum(map(len, value))
+
+
+class ResultCache:
+
+    def __init__(self, max_memory_bytes=DEFAULT_MEMORY_BYTES, disk_dir=None, max_disk_bytes=DEFAULT_DISK_BYTES):
+        """
+        `disk_dir` enables the disk tier, existing entries in it are picked up (oldest first)
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            for entry in sorted(self.disk_dir.iterdir(), key=lambda p: p.stat().st_mtime):
+                self._disk[entry.name] = entry.stat().st_size
+                self._disk_bytes += entry.stat().st_size
+
+    @staticmethod
+    def key(image_id, operation, *params):
+        """
+        Cache key of `operation` (with `params`) applied to the image identified by `image_id`
+        """
+        return content_hash('\0'.join(map(str, (image_id, operation) + params)).encode())
+
+    def get(self, key):
+        """
+        Returns the cached bytes for `key`, or None. Disk hits are promoted to the memory tier.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+            if key in self._disk:
+                try:
+                    data = (self.disk_dir / key).read_bytes()
+                except FileNotFoundError:
+                    self._disk_bytes -= self._disk.pop(key)
+                else:
+                    self._disk.move_to_end(key)
+                    os.utime(self.disk_dir / key)
+                    self._put_memory(key, data)
+                    self.hits += 1
+                    return data
+
+            self.misses += 1
+            return None
+
+    def put(self, key, data):
+        with self._lock:
+            self._put_memory(key, data)
+
+            if self.disk_dir and isinstance(data, bytes) and len(data) <= self.max_disk_bytes:
+                (self.disk_dir / key).write_bytes(data)
+                self._disk_bytes += len(data) - self._disk.pop(key, 0)
+                self._disk[key] = len(data)
+                while self._disk_bytes > self.max_disk_bytes:
+                    old_key, size = self._disk.popitem(last=False)
+                    (self.disk_dir / old_key).unlink(missing_ok=True)
+                    self._disk_bytes -= size
+
+    def _put_memory(self, key, data):
+        if _size(data) > self.max_memory_bytes:
+            return
+
+        self._memory_bytes += _size(data) - _size(self._memory.pop(key, b''))
+        self._memory[key] = data
+        while self._memory_bytes > self.max_memory_bytes:
+            _, old_data = self._memory.popitem(last=False)
+            self._memory_bytes -= _size(old_data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+            }
@@ -0,0 +1,73 @@
+import unittest
+import numpy as np
+from polybot.benchmark import (OPERATIONS, compare, measure, measure_startup, run_codecs, run_startup,
+                               run_suite, synthetic_pixels)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.report = run_suite(sizes=(64,), sample_image=None, repeats=1)
+
+    def test_every_operation_measured(self):
+        measured = {r['operation'] for r in self.report['results']}
+        self.assertEqual(measured, set(OPERATIONS))
+
+        for result in self.report['results']:
+            self.assertEqual((result['width'], result['height']), (64, 64))
+            self.assertGreater(result['megapixels_per_second'], 0)
+            self.assertGreaterEqual(result['peak_memory_bytes'], 0)
+
+    def test_no_regression_against_itself(self):
+        self.assertEqual(compare(self.report, self.report), [])
+
+    def test_regression_detected(self):
+        baseline = {'results': [dict(r, seconds=r['seconds'] / 2) for r in self.report['results']]}
+        regressions = compare(self.report, baseline, time_threshold=0.5)
+        self.assertEqual(len(regressions), len(self.report['results']))
+
+    def test_rotation_is_materialized(self):
+        # rotate only makes a view, the measured memory is the copy the encoder makes of it
+        pixels = synthetic_pixels(1024)
+        seconds, peak_memory = measure('rotate', pixels, repeats=1)
+        self.assertGreater(peak_memory, pixels.nbytes / 2)
+
+    def test_memory_of_the_step_alone(self):
+        # The input and the setup are resident before the high-water mark is reset
+        seconds, peak_memory = measure('blur', synthetic_pixels(1024), repeats=1)
+        self.assertLess(peak_memory, 12 * 1024 * 1024 * 4)
+
+    def test_codecs(self):
+        results = run_codecs({'synthetic_64': synthetic_pixels(64)}, codecs=['pil'], max_dimension=32, repeats=1)
+        self.assertEqual({r['operation'] for r in results},
+                         {'pil_encode_jpeg', 'pil_decode_jpeg', 'pil_decode_jpeg_max32',
+                          'pil_encode_png', 'pil_decode_png', 'pil_decode_png_max32'})
+        self.assertTrue(all(r['encoded_bytes'] > 0 for r in results))
+
+        baseline = {'results': [dict(r, encoded_bytes=r['encoded_bytes'] // 2) for r in results]}
+        self.assertEqual(len(compare({'results': results}, baseline, time_threshold=100)), len(results))
+
+    def test_codec_memory_includes_c_buffers(self):
+        # A PIL decode holds the decoded image in PIL's own (C) buffer, the bytes exported from it and
+        # the NumPy array copied from those: three images' worth, one of them invisible to tracemalloc
+        pixels = synthetic_pixels(2048)
+        result, = [r for r in run_codecs({'synthetic_2048': pixels}, codecs=['pil'], formats=['png'],
+                                         max_dimension=0, repeats=1) if r['operation'] == 'pil_decode_png']
+        self.assertGreater(result['peak_memory_bytes'], 2.5 * pixels.size)
+
+    def test_startup(self):
+        result, = run_startup(['import_img_proc'], repeats=1)
+        self.assertEqual((result['operation'], result['image']), ('import_img_proc', 'startup'))
+        self.assertGreater(result['seconds'], 0)
+        self.assertGreater(result['peak_memory_bytes'], 0)
+
+    def test_startup_memory_is_the_probe_own(self):
+        # The probe's peak must not include the memory of the process running the benchmark
+        ballast = np.ones(512 * 2 ** 20, dtype=np.uint8)
+        seconds, peak_memory = measure_startup('pass', repeats=1)
+        self.assertLess(peak_memory, ballast.nbytes / 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from polybot.img_proc import Img
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+class TestImgBlur(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+        self.original_dimension = (len(self.img.data), len(self.img.data[0]))
+
+    def test_blur_dimension(self):
+        blur_level = 16
+        self.img.blur(blur_level)
+        actual_dimension = (len(self.img.data), len(self.img.data[0]))
+        expected_dimension = (self.original_dimension[0] - blur_level + 1, self.original_dimension[1] - blur_level + 1)
+        self.assertEqual(expected_dimension, actual_dimension)
+
+    def test_blur_matches_window_average(self):
+        blur_level = 5
+        original = [row[:40] for row in self.img.data[:30]]
+        self.img.data = [list(row) for row in original]
+        self.img.blur(blur_level)
+
+        for i in range(len(original) - blur_level + 1):
+            for j in range(len(original[0]) - blur_level + 1):
+                window = sum(sum(row[j:j + blur_level]) for row in original[i:i + blur_level])
+                self.assertEqual(self.img.data[i][j], window // blur_level ** 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
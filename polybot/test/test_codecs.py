@@ -0,0 +1,93 @@
+import unittest
+import io
+import os
+import numpy as np
+from PIL import Image
+from polybot.img_codecs import CODECS, MatplotlibCodec, PILCodec, capped_size, get_codec, register_codec, to_levels
+from polybot.img_proc import Img
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+class TestPILCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.codec = PILCodec()
+        rng = np.random.default_rng(0)
+        self.pixels = rng.random((48, 64), dtype=np.float32) * 200 + 20
+
+    def test_decode_is_luma(self):
+        decoded = self.codec.decode(img_path)
+        with Image.open(img_path) as image:
+            self.assertEqual(decoded.shape, (image.height, image.width))
+        self.assertEqual(decoded.dtype, np.uint8)
+
+    def test_decoded_pixels_are_writable(self):
+        self.assertTrue(self.codec.decode(img_path).flags.writeable)
+
+        # uint8 Imgs keep the decoded matrix as their buffer, in-place filters and writes must work
+        img = Img(img_path, dtype=np.uint8)
+        img.data[3][5] = 7
+        self.assertEqual(img.pixels[3, 5], 7)
+        img.salt_n_pepper(seed=0)
+        self.assertTrue(np.isin(img.pixels, (0, 255)).any())
+
+    def test_png_round_trip(self):
+        levels = to_levels(self.pixels)
+        decoded = self.codec.decode(io.BytesIO(self.codec.encode(self.pixels, 'png')))
+        self.assertTrue(np.array_equal(decoded, levels))
+
+    def test_same_levels_as_matplotlib(self):
+        # Both scale min..max to 8-bit gray, the PIL codec without the RGBA colormap render
+        # (whose float to byte truncation puts some levels one lower)
+        ours = self.codec.decode(io.BytesIO(self.codec.encode(self.pixels, 'png'))).astype(int)
+        theirs = self.codec.decode(io.BytesIO(MatplotlibCodec().encode(self.pixels, 'png'))).astype(int)
+        self.assertLessEqual(np.abs(ours - theirs).max(), 1)
+
+    def test_max_dimension(self):
+        with open(img_path, 'rb') as f:
+            data = f.read()
+        with Image.open(img_path) as image:
+            expected = capped_size(image.size, 100)
+
+        decoded = self.codec.decode(io.BytesIO(data), 'jpeg', max_dimension=100)
+        self.assertEqual(decoded.shape, (expected[1], expected[0]))
+        self.assertEqual(max(decoded.shape), 100)
+
+        png = self.codec.encode(self.pixels, 'png')
+        self.assertEqual(self.codec.decode(io.BytesIO(png), 'png', max_dimension=16).shape, (12, 16))
+        # Smaller images are left alone
+        self.assertEqual(self.codec.decode(io.BytesIO(png), 'png', max_dimension=1000).shape, (48, 64))
+
+    def test_constant_image(self):
+        decoded = self.codec.decode(io.BytesIO(self.codec.encode(np.full((4, 4), 7.0), 'png')))
+        self.assertTrue(np.array_equal(decoded, np.zeros((4, 4), dtype=np.uint8)))
+
+
+class TestCodecRegistry(unittest.TestCase):
+
+    def test_default_codec(self):
+        self.assertIsInstance(get_codec(), PILCodec)
+        self.assertIsInstance(Img(img_path).codec, PILCodec)
+
+    def test_img_with_codec(self):
+        img = Img(img_path, codec='matplotlib', max_dimension=64)
+        self.assertIsInstance(img.codec, MatplotlibCodec)
+        self.assertLessEqual(max(img.pixels.shape), 64)
+
+    def test_register_codec(self):
+        register_codec('test', PILCodec())
+        try:
+            self.assertIs(get_codec('test'), CODECS['test'])
+            self.assertTrue(Img(img_path, codec='test').encode())
+        finally:
+            del CODECS['test']
+
+    def test_img_max_dimension(self):
+        with open(img_path, 'rb') as f:
+            img = Img('photo.jpeg', encoded=f.read(), max_dimension=100)
+        self.assertEqual(max(img.pixels.shape), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
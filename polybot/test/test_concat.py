@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 from polybot.img_proc import Img
 import os
 
@@ -37,5 +38,28 @@ class TestImgConcat(unittest.TestCase):
         self.assertEqual(left_half, right_half)
 
 
+class TestImgConcatAll(unittest.TestCase):
+
+    def setUp(self):
+        self.images = [Img(f'{i}.png', pixels=np.full(shape, i, dtype=np.float32))
+                       for i, shape in enumerate(((40, 30), (50, 20), (45, 10)))]
+
+    def test_every_image_keeps_its_width(self):
+        self.images[0].concat_all(self.images[1:])
+
+        pixels = self.images[0].pixels
+        self.assertEqual(pixels.shape, (40, 60))
+        np.testing.assert_array_equal(pixels[:, :30], 0)
+        np.testing.assert_array_equal(pixels[:, 30:50], 1)
+        np.testing.assert_array_equal(pixels[:, 50:], 2)
+
+    def test_vertical(self):
+        self.images[0].concat_all(self.images[1:], direction='vertical')
+
+        pixels = self.images[0].pixels
+        self.assertEqual(pixels.shape, (135, 10))
+        np.testing.assert_array_equal(pixels[40:90], 1)
+
+
 if __name__ == '__main__':
     unittest.main()
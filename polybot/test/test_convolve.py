@@ -0,0 +1,118 @@
+import unittest
+import os
+import numpy as np
+from polybot.img_convolve import (box_kernel, choose_strategy, convolve, CONTOUR_KERNEL, gaussian_kernel,
+                                  separable_factors, sharpen_kernel, SOBEL_X, STRATEGIES, _fast_length)
+from polybot.img_proc import Img
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+class TestConvolve(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.pixels = (rng.random((61, 47)) * 255).astype(np.float32)
+
+    def test_strategies_agree(self):
+        for kernel in (box_kernel(5), gaussian_kernel(1.5), SOBEL_X, CONTOUR_KERNEL):
+            direct = convolve(self.pixels, kernel, strategy='direct')
+            for strategy in STRATEGIES:
+                result = convolve(self.pixels, kernel, strategy=strategy)
+                self.assertEqual(result.shape, direct.shape)
+                self.assertTrue(np.allclose(result, direct, atol=1e-2), f'{strategy} differs from direct')
+
+    def test_matches_definition(self):
+        kernel = np.arange(6, dtype=np.float32).reshape(2, 3)
+        result = convolve(self.pixels, kernel, strategy='fft')
+        expected = np.array([[np.sum(self.pixels[i:i + 2, j:j + 3] * kernel[::-1, ::-1])
+                              for j in range(45)] for i in range(60)])
+        self.assertTrue(np.allclose(result, expected, rtol=1e-4))
+
+    def test_same_mode_keeps_the_shape(self):
+        for kernel in (box_kernel(4), gaussian_kernel(2), SOBEL_X):
+            self.assertEqual(convolve(self.pixels, kernel, 'same').shape, self.pixels.shape)
+
+    def test_non_separable_kernel(self):
+        self.assertIsNone(separable_factors(sharpen_kernel()))
+        with self.assertRaises(ValueError):
+            convolve(self.pixels, sharpen_kernel(), strategy='separable')
+        self.assertNotEqual(choose_strategy((1000, 1000), sharpen_kernel()), 'separable')
+
+    def test_strategy_choice(self):
+        # Large separable kernels go through two 1-D passes, large dense ones through the FFT
+        self.assertEqual(choose_strategy((1000, 1000), box_kernel(15)), 'separable')
+        dense = np.random.default_rng(1).random((31, 31), dtype=np.float32)
+        self.assertEqual(choose_strategy((1000, 1000), dense), 'fft')
+        self.assertEqual(choose_strategy((1000, 1000), CONTOUR_KERNEL), 'direct')
+
+    def test_fast_length(self):
+        for n in (1, 7, 97, 1000, 1025):
+            length = _fast_length(n)
+            self.assertGreaterEqual(length, n)
+            factor = length
+            for prime in (2, 3, 5):
+                while factor % prime == 0:
+                    factor //= prime
+            self.assertEqual(factor, 1)
+
+
+class TestImgConvolve(unittest.TestCase):
+
+    def test_blur_through_convolve(self):
+        for workers in (1, 3):
+            blurred = Img(img_path, workers=workers)
+            convolved = Img(img_path, workers=workers)
+            blurred.blur(9)
+            convolved.convolve(box_kernel(9), mode='valid')
+            self.assertEqual(blurred.pixels.shape, convolved.pixels.shape)
+            # blur rounds the window average down
+            difference = convolved.pixels - blurred.pixels
+            self.assertGreaterEqual(difference.min(), -1e-2)
+            self.assertLess(difference.max(), 1)
+
+    def test_contour_through_convolve(self):
+        contoured = Img(img_path)
+        convolved = Img(img_path)
+        contoured.contour()
+        convolved.convolve(CONTOUR_KERNEL, mode='valid', strategy='direct')
+        self.assertTrue(np.allclose(contoured.pixels, np.abs(convolved.pixels)))
+
+    def test_filters_keep_the_shape(self):
+        for operation in ('gaussian_blur', 'sharpen', 'sobel'):
+            for workers in (1, 3):
+                img = Img(img_path, workers=workers)
+                shape = img.pixels.shape
+                getattr(img, operation)()
+                self.assertEqual(img.pixels.shape, shape, operation)
+
+    def test_sharpen_is_clipped(self):
+        img = Img(img_path)
+        img.sharpen(amount=4)
+        self.assertGreaterEqual(img.pixels.min(), 0)
+        self.assertLessEqual(img.pixels.max(), 255)
+
+    def test_gaussian_blur_smooths(self):
+        img = Img(img_path)
+        original = img.pixels.astype(np.float64)
+        img.gaussian_blur(sigma=2)
+        self.assertLess(np.abs(np.diff(img.pixels.astype(np.float64), axis=1)).mean(),
+                        np.abs(np.diff(original, axis=1)).mean())
+
+    def test_sobel_of_flat_image_is_zero(self):
+        img = Img('flat.png', pixels=np.full((20, 30), 128, dtype=np.float32))
+        img.sobel()
+        self.assertTrue(np.allclose(img.pixels, 0))
+
+    def test_lazy_pipeline(self):
+        eager = Img(img_path)
+        eager.gaussian_blur()
+        eager.sobel()
+        lazy = Img(img_path, lazy=True)
+        lazy.gaussian_blur()
+        lazy.sobel()
+        self.assertTrue(np.allclose(lazy.pixels, eager.pixels))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+import unittest
+from unittest.mock import patch, Mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import json
+import threading
+import time
+import boto3
+import requests
+from moto import mock_aws
+from polybot.bot import ObjectDetectionBot
+from polybot.detection import (CircuitBreaker, DetectionClient, DetectionUnavailable, format_prediction,
+                               make_session)
+from polybot.jobs import JobScheduler
+
+BUCKET = 'polybot-test'
+
+mock_msg = {
+    'message_id': 411,
+    'chat': {'id': 1243002838, 'type': 'private'},
+    'photo': [{'file_id': 'AgACAgQAAxkDAAIBXWS89nwr4unz', 'file_unique_id': 'AQADAb8xG8e94FF9'}],
+}
+
+
+class FakeYolo5(ThreadingHTTPServer):
+    """
+    Stand-in for the yolo5 service: answers /predict with `labels`, or with the queued `statuses` first
+    """
+
+    def __init__(self, labels=(), delay=0):
+        super().__init__(('127.0.0.1', 0), FakeYolo5Handler)
+        self.labels = list(labels)
+        self.delay = delay
+        self.statuses = []
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class FakeYolo5Handler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            img_name = parse_qs(urlparse(self.path).query)['imgName'][0]
+            server.requests.append(img_name)
+            status = server.statuses.pop(0) if server.statuses else 200
+        time.sleep(server.delay)
+
+        body = json.dumps({'prediction_id': str(len(server.requests)), 'original_img_path': img_name,
+                           'labels': server.labels}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with server.lock:
+            server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class TestDetectionClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = start_server(FakeYolo5(labels=[{'class': 'person'}]))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_predict(self):
+        client = DetectionClient(self.server.url)
+        prediction = client.predict('photos/1.jpeg')
+        self.assertEqual(prediction['labels'], [{'class': 'person'}])
+        self.assertEqual(self.server.requests, ['photos/1.jpeg'])
+
+    def test_retries_unavailable_service(self):
+        self.server.statuses = [503, 503]
+        client = DetectionClient(self.server.url, session=make_session(retries=3, backoff=0))
+        self.assertEqual(client.predict('photos/1.jpeg')['labels'], [{'class': 'person'}])
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(client.breaker.state, 'closed')
+
+    def test_bounded_concurrency(self):
+        self.server.delay = 0.05
+        client = DetectionClient(self.server.url, max_concurrency=2)
+        threads = [threading.Thread(target=client.predict, args=(f'photos/{i}.jpeg',)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertLessEqual(self.server.max_in_flight, 2)
+
+    def test_timeout(self):
+        self.server.delay = 0.5
+        client = DetectionClient(self.server.url, session=make_session(retries=0), timeout=(1, 0.05))
+        with self.assertRaises(requests.RequestException):
+            client.predict('photos/1.jpeg')
+
+    def test_read_timeout_is_not_retried(self):
+        # yolo5 may still be running the inference, a retry would run it again
+        self.server.delay = 0.3
+        client = DetectionClient(self.server.url, session=make_session(retries=3, backoff=0), timeout=(1, 0.05))
+        with self.assertRaises(requests.RequestException):
+            client.predict('photos/1.jpeg')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_circuit_opens_and_recovers(self):
+        self.server.statuses = [500, 500]
+        client = DetectionClient(self.server.url, session=make_session(retries=0),
+                                 breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.2))
+        for _ in range(2):
+            with self.assertRaises(requests.HTTPError):
+                client.predict('photos/1.jpeg')
+
+        # Open: failing fast, the service is not called
+        with self.assertRaises(DetectionUnavailable):
+            client.predict('photos/1.jpeg')
+        self.assertEqual(len(self.server.requests), 2)
+
+        # After the reset timeout a trial request goes through and closes the circuit
+        time.sleep(0.25)
+        self.assertEqual(client.breaker.state, 'half_open')
+        client.predict('photos/1.jpeg')
+        self.assertEqual(client.breaker.state, 'closed')
+
+    def test_client_errors_do_not_open_the_circuit(self):
+        self.server.statuses = [404, 404]
+        client = DetectionClient(self.server.url, session=make_session(retries=0),
+                                 breaker=CircuitBreaker(failure_threshold=2))
+        for _ in range(2):
+            with self.assertRaises(requests.HTTPError):
+                client.predict('photos/missing.jpeg')
+        self.assertEqual(client.breaker.state, 'closed')
+
+    def test_format_prediction(self):
+        labels = [{'class': 'dog'}, {'class': 'person'}, {'class': 'person'}]
+        self.assertEqual(format_prediction({'labels': labels}), 'Detected objects:\nperson: 2\ndog: 1')
+        self.assertEqual(format_prediction({'labels': []}), 'No objects detected.')
+
+
+class TestObjectDetectionBot(unittest.TestCase):
+
+    @patch('telebot.TeleBot')
+    def setUp(self, mock_telebot):
+        self.aws = mock_aws()
+        self.aws.start()
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=BUCKET)
+
+        self.server = start_server(FakeYolo5(labels=[{'class': 'person'}, {'class': 'person'}, {'class': 'cat'}]))
+        self.bot = ObjectDetectionBot('bot_token', 'webhook_url', bucket=BUCKET, s3_client=self.s3,
+                                      detection_client=DetectionClient(self.server.url,
+                                                                       session=make_session(retries=0)),
+                                      scheduler=JobScheduler(workers=4))
+        self.bot.telegram_bot_client = mock_telebot.return_value
+        self.bot.telegram_bot_client.get_file.return_value = Mock(file_path='photos/file_7.jpg')
+        self.bot.telegram_bot_client.download_file.return_value = b'jpeg bytes'
+
+    def tearDown(self):
+        self.bot.shutdown()
+        self.server.shutdown()
+        self.server.server_close()
+        self.aws.stop()
+
+    def test_photo_is_uploaded_and_predicted(self):
+        self.bot.handle_message(mock_msg)
+        self.bot.scheduler.join()
+
+        key = 'photos/1243002838/411_file_7.jpg'
+        self.assertEqual(self.s3.get_object(Bucket=BUCKET, Key=key)['Body'].read(), b'jpeg bytes')
+        self.assertEqual(self.server.requests, [key])
+        self.bot.telegram_bot_client.send_message.assert_called_once_with(
+            1243002838, 'Detected objects:\nperson: 2\ncat: 1', reply_to_message_id=411)
+
+    def test_photos_run_concurrently(self):
+        self.server.delay = 0.1
+        for message_id in range(4):
+            self.bot.handle_message(dict(mock_msg, message_id=message_id))
+        self.bot.scheduler.join()
+
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertGreater(self.server.max_in_flight, 1)
+        self.assertEqual(self.bot.telegram_bot_client.send_message.call_count, 4)
+
+    def test_service_error(self):
+        self.server.statuses = [500]
+        self.bot.handle_message(mock_msg)
+        self.bot.scheduler.join()
+
+        self.bot.telegram_bot_client.send_message.assert_called_once_with(
+            1243002838, 'Object detection service error.', reply_to_message_id=411)
+
+    def test_open_circuit(self):
+        self.bot.detection_client.breaker.opened_at = time.monotonic()
+        self.bot.handle_message(mock_msg)
+        self.bot.scheduler.join()
+
+        self.assertEqual(self.server.requests, [])
+        text = self.bot.telegram_bot_client.send_message.call_args.args[1]
+        self.assertIn('unavailable', text)
+
+    def test_text_message(self):
+        self.bot.handle_message({'message_id': 1, 'chat': {'id': 5}, 'text': 'hi'})
+        self.bot.scheduler.join()
+
+        self.bot.telegram_bot_client.send_message.assert_called_once()
+        self.assertEqual(self.server.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import threading
+import time
+from polybot.jobs import JobScheduler, QueueFull
+
+
+class TestJobScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = JobScheduler(workers=4, max_queued=50)
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+
+    def test_per_key_fifo(self):
+        results = {'a': [], 'b': []}
+
+        for i in range(20):
+            for key in results:
+                self.scheduler.submit(key, lambda key=key, i=i: (time.sleep(0.001), results[key].append(i)))
+
+        self.assertTrue(self.scheduler.join(timeout=10))
+        self.assertEqual(results, {'a': list(range(20)), 'b': list(range(20))})
+
+    def test_keys_run_in_parallel(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        for key in ('a', 'b', 'c'):
+            self.scheduler.submit(key, barrier.wait)
+
+        self.assertTrue(self.scheduler.join(timeout=10))
+        self.assertFalse(barrier.broken)
+
+    def test_same_key_never_concurrent(self):
+        running = []
+        max_running = []
+
+        def job():
+            running.append(1)
+            max_running.append(len(running))
+            time.sleep(0.005)
+            running.pop()
+
+        for _ in range(5):
+            self.scheduler.submit('a', job)
+
+        self.assertTrue(self.scheduler.join(timeout=10))
+        self.assertEqual(max_running, [1] * 5)
+
+    def test_bounded_queue(self):
+        blocked = JobScheduler(workers=0, max_queued=2)
+        self.assertEqual(blocked.submit('a', lambda: None), 1)
+        self.assertEqual(blocked.submit('b', lambda: None), 2)
+        with self.assertRaises(QueueFull):
+            blocked.submit('c', lambda: None)
+
+    def test_position_counts_busy_workers(self):
+        scheduler = JobScheduler(workers=2)
+        release = threading.Event()
+        self.assertEqual(scheduler.submit('a', release.wait), 0)
+        self.assertEqual(scheduler.submit('b', release.wait), 0)
+        # Both workers are busy: the next jobs wait, whatever their key
+        self.assertEqual(scheduler.submit('c', lambda: None), 1)
+        self.assertEqual(scheduler.submit('d', lambda: None), 2)
+        release.set()
+        self.assertTrue(scheduler.join(timeout=10))
+
+        # A job behind another of the same key waits even with idle workers
+        scheduler.submit('a', lambda: time.sleep(0.05))
+        self.assertEqual(scheduler.submit('a', lambda: None), 1)
+        self.assertTrue(scheduler.join(timeout=10))
+        scheduler.shutdown()
+
+    def test_shutdown_drains_queue(self):
+        done = []
+        for i in range(10):
+            self.scheduler.submit(i % 3, lambda i=i: done.append(i))
+
+        self.scheduler.shutdown()
+        self.assertEqual(sorted(done), list(range(10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import numpy as np
+from polybot.img_proc import Img, as_pixels
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+# Reference implementations: the original nested-list versions of the filters
+
+def list_contour(data):
+    return [[abs(row[j - 1] - row[j]) for j in range(1, len(row))] for row in data]
+
+
+def list_rotate(data):
+    height = len(data)
+    width = len(data[0])
+    rotated_data = [[0 for i in range(height)] for i in range(width)]
+    for x in range(width):
+        for y in range(height):
+            rotated_data[x][y] = data[height - y - 1][x]
+    return rotated_data
+
+
+def list_concat(data, other_data, direction='horizontal'):
+    height = min(len(data), len(other_data))
+    width = min(len(data[0]), len(other_data[0]))
+    if direction == 'horizontal':
+        return [data[i][:width] + other_data[i][:width] for i in range(height)]
+    return [row[:width] for row in data[:height] + other_data[:height]]
+
+
+def list_segment(data, num_segments=4):
+    height = len(data)
+    segment_height = height // num_segments
+    segments = []
+    for i in range(num_segments):
+        start_row = i * segment_height
+        end_row = start_row + segment_height if i != num_segments - 1 else height
+        segments.append(data[start_row:end_row])
+    return segments
+
+
+class TestImgKernels(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+        self.as_lists = self.img.pixels.tolist()
+
+    def test_contour_equivalence(self):
+        self.img.contour()
+        np.testing.assert_array_equal(self.img.pixels, as_pixels(list_contour(self.as_lists)))
+
+    def test_rotate_equivalence(self):
+        self.img.rotate()
+        np.testing.assert_array_equal(self.img.pixels, as_pixels(list_rotate(self.as_lists)))
+
+    def test_rotate_is_a_view(self):
+        original = self.img.pixels
+        self.img.rotate()
+        self.assertTrue(np.shares_memory(self.img.pixels, original))
+
+    def test_concat_equivalence(self):
+        other_img = Img(img_path)
+        other_img.pixels = other_img.pixels[:-7, 3:]
+        other_lists = other_img.pixels.tolist()
+
+        for direction in ('horizontal', 'vertical'):
+            img = Img(img_path)
+            img.concat(other_img, direction)
+            np.testing.assert_array_equal(img.pixels, as_pixels(list_concat(self.as_lists, other_lists, direction)))
+
+    def test_segment_equivalence(self):
+        segments = self.img.segment(3)
+        expected = list_segment(self.as_lists, 3)
+
+        self.assertEqual(len(segments), len(expected))
+        for segment, expected_segment in zip(segments, expected):
+            np.testing.assert_array_equal(segment, as_pixels(expected_segment))
+            self.assertTrue(np.shares_memory(segment, self.img.pixels))
+
+    def test_encode_segments(self):
+        segments = self.img.segment(3)
+        encoded = self.img.encode_segments(workers=3)
+
+        self.assertEqual(len(encoded), 3)
+        for segment, data in zip(segments, encoded):
+            self.assertEqual(Img('segment.jpeg', encoded=data).pixels.shape, segment.shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
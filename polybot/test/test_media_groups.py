@@ -0,0 +1,48 @@
+import unittest
+import threading
+from polybot.media_groups import MediaGroupAggregator
+
+
+class TestMediaGroupAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.completed = []
+        self.done = threading.Event()
+
+        def on_complete(msgs):
+            self.completed.append(msgs)
+            self.done.set()
+
+        self.aggregator = MediaGroupAggregator(on_complete, timeout=0.05, max_groups=2, max_parts=3)
+
+    def test_group_completes_after_timeout(self):
+        self.aggregator.add({'media_group_id': 'g', 'message_id': 2})
+        self.aggregator.add({'media_group_id': 'g', 'message_id': 1})
+
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.completed, [[{'media_group_id': 'g', 'message_id': 1},
+                                           {'media_group_id': 'g', 'message_id': 2}]])
+        self.assertEqual(self.aggregator.pending(), 0)
+
+    def test_flush(self):
+        self.aggregator.add({'media_group_id': 'a', 'message_id': 1})
+        self.aggregator.add({'media_group_id': 'b', 'message_id': 2})
+        self.aggregator.flush()
+
+        self.assertEqual(sorted(msgs[0]['media_group_id'] for msgs in self.completed), ['a', 'b'])
+
+    def test_bounded_groups_and_parts(self):
+        self.assertTrue(self.aggregator.add({'media_group_id': 'a', 'message_id': 1}))
+        self.assertTrue(self.aggregator.add({'media_group_id': 'b', 'message_id': 1}))
+        self.assertFalse(self.aggregator.add({'media_group_id': 'c', 'message_id': 1}))
+
+        for message_id in range(2, 6):
+            self.assertTrue(self.aggregator.add({'media_group_id': 'a', 'message_id': message_id}))
+        self.aggregator.flush()
+
+        group_sizes = {msgs[0]['media_group_id']: len(msgs) for msgs in self.completed}
+        self.assertEqual(group_sizes, {'a': 3, 'b': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
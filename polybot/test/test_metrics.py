@@ -0,0 +1,95 @@
+import unittest
+import threading
+import time
+from polybot.metrics import Histogram, Metrics, SamplingProfiler
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics(buckets=(0.01, 0.1, 1))
+
+    def test_span(self):
+        with self.metrics.span('filter', '1/2'):
+            time.sleep(0.02)
+        with self.assertRaises(ValueError):
+            with self.metrics.span('upload', '1/2'):
+                raise ValueError()
+
+        trace = self.metrics.trace('1/2')
+        self.assertEqual([stage for stage, _ in trace], ['filter', 'upload'])
+        self.assertGreaterEqual(trace[0][1], 0.02)
+        self.assertEqual(self.metrics.histogram('filter').counts, [0, 1, 0, 0])
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(0.01, 0.1, 1))
+        for value in (0.005, 0.05, 0.05, 0.5, 5):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(1), float('inf'))
+
+    def test_render(self):
+        self.metrics.observe('download', 0.05)
+        self.metrics.gauge('processing_jobs_queued', lambda: 3)
+        self.metrics.gauge('broken', lambda: 1 / 0)
+
+        text = self.metrics.render()
+        self.assertIn('stage_latency_seconds_bucket{stage="download",le="0.01"} 0', text)
+        self.assertIn('stage_latency_seconds_bucket{stage="download",le="0.1"} 1', text)
+        self.assertIn('stage_latency_seconds_bucket{stage="download",le="+Inf"} 1', text)
+        self.assertIn('stage_latency_seconds_count{stage="download"} 1', text)
+        self.assertIn('processing_jobs_queued 3', text)
+        self.assertIn('# TYPE processing_jobs_queued gauge', text)
+        self.assertNotIn('broken', text)
+
+    def test_counters(self):
+        self.metrics.counter('result_cache_hits_total', lambda: 7)
+
+        text = self.metrics.render()
+        self.assertIn('# TYPE result_cache_hits_total counter\nresult_cache_hits_total 7', text)
+
+    def test_traces_are_bounded(self):
+        metrics = Metrics(remembered_traces=2)
+        for job_id in range(3):
+            metrics.observe('filter', 0.1, job_id)
+
+        self.assertEqual(metrics.trace(0), [])
+        self.assertEqual(len(metrics.trace(2)), 1)
+
+    def test_profiler(self):
+        self.metrics.start_profiler(interval=0.001)
+        time.sleep(0.1)
+        self.metrics.stop_profiler()
+
+        self.assertFalse(self.metrics.profiler.running)
+        self.assertTrue(self.metrics.profiler.samples)
+        self.assertIn('test_profiler', self.metrics.profiler.collapsed())
+
+    def test_profiler_stacks_are_bounded(self):
+        # Two threads, two distinct stacks: only the first one seen is kept
+        stop = threading.Event()
+        waiter = threading.Thread(target=stop.wait)
+        waiter.start()
+        profiler = SamplingProfiler(interval=0.001, max_stacks=1)
+        profiler.start()
+        time.sleep(0.1)
+        profiler.stop()
+        stop.set()
+        waiter.join()
+
+        self.assertEqual(len(profiler.samples), 1)
+        self.assertGreater(profiler.dropped, 0)
+
+    def test_debug_token(self):
+        self.assertFalse(Metrics(debug_token='').allows_debug(''))
+        self.assertFalse(Metrics(debug_token='').allows_debug(None))
+        metrics = Metrics(debug_token='s3cret')
+        self.assertTrue(metrics.allows_debug('s3cret'))
+        self.assertFalse(metrics.allows_debug('guess'))
+        self.assertFalse(metrics.allows_debug(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import numpy as np
+from polybot import img_parallel
+from polybot.img_proc import Img
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+class TestImgParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+        self.parallel_img = Img(img_path, workers=3)
+
+    def test_blur_bit_identical(self):
+        self.img.blur()
+        self.parallel_img.blur()
+        np.testing.assert_array_equal(self.parallel_img.pixels, self.img.pixels)
+
+    def test_contour_bit_identical(self):
+        self.img.rotate()
+        self.img.contour()
+        self.parallel_img.rotate()
+        self.parallel_img.contour()
+        np.testing.assert_array_equal(self.parallel_img.pixels, self.img.pixels)
+
+    def test_uint8_bit_identical(self):
+        img = Img(img_path, dtype=np.uint8)
+        parallel_img = Img(img_path, dtype=np.uint8, workers=2)
+        img.blur(5)
+        parallel_img.blur(5)
+        self.assertEqual(parallel_img.pixels.dtype, np.uint8)
+        np.testing.assert_array_equal(parallel_img.pixels, img.pixels)
+
+
+class TestPools(unittest.TestCase):
+
+    def test_workers_are_not_forked(self):
+        pool = img_parallel.get_pool(2)
+        self.assertEqual(pool._mp_context.get_start_method(), 'forkserver')
+
+    def test_shutdown_pools(self):
+        img = Img(img_path)
+        parallel_img = Img(img_path, workers=2)
+        parallel_img.blur()
+        pool = img_parallel.get_pool(2)
+        img_parallel.shutdown_pools()
+        self.assertEqual(img_parallel._pools, {})
+        with self.assertRaises(RuntimeError):
+            pool.submit(int)
+
+        # A new pool is started on demand
+        img.blur()
+        parallel_img = Img(img_path, workers=2)
+        parallel_img.blur()
+        np.testing.assert_array_equal(parallel_img.pixels, img.pixels)
+        self.assertIsNot(img_parallel.get_pool(2), pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
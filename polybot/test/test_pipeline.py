@@ -0,0 +1,55 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+from polybot import img_proc
+from polybot.img_proc import Img
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+class TestImgPipeline(unittest.TestCase):
+
+    def test_lazy_chain_matches_eager(self):
+        eager_img = Img(img_path)
+        eager_img.rotate()
+        eager_img.contour()
+        eager_img.rotate()
+        eager_img.blur(4)
+
+        lazy_img = Img(img_path, lazy=True)
+        lazy_img.rotate().contour().rotate().blur(4)
+
+        np.testing.assert_array_equal(lazy_img.pixels, eager_img.pixels)
+
+    def test_plan_runs_only_when_data_is_read(self):
+        img = Img(img_path, lazy=True)
+
+        with patch('polybot.img_proc.integral_image', wraps=img_proc.integral_image) as mock_sat:
+            img.blur()
+            mock_sat.assert_not_called()
+
+            len(img.data)
+            mock_sat.assert_called_once()
+
+    def test_rotations_are_folded(self):
+        img = Img(img_path, lazy=True)
+        original = img._pixels
+
+        img.rotate().rotate().rotate().rotate()
+
+        self.assertIs(img.pixels, original)
+
+    def test_lazy_segment(self):
+        img = Img(img_path, lazy=True)
+        eager_img = Img(img_path)
+
+        self.assertIs(img.rotate().segment(), img)
+        eager_img.rotate()
+
+        for segment, expected_segment in zip(img.segments, eager_img.segment()):
+            np.testing.assert_array_equal(segment, expected_segment)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import numpy as np
+from polybot.img_proc import Img
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+class TestImgPixelStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+
+    def test_contiguous_float32_buffer(self):
+        self.assertEqual(self.img.pixels.dtype, np.float32)
+        self.assertTrue(self.img.pixels.flags['C_CONTIGUOUS'])
+        self.assertEqual(self.img.pixels.shape, (len(self.img.data), len(self.img.data[0])))
+
+    def test_uint8_buffer(self):
+        img = Img(img_path, dtype=np.uint8)
+        self.assertEqual(img.pixels.dtype, np.uint8)
+        self.assertEqual(img.pixels.nbytes, len(img.data) * len(img.data[0]))
+        self.assertTrue(np.all(np.abs(img.pixels - self.img.pixels) <= 0.5))
+
+    def test_data_view_reads_and_writes_buffer(self):
+        self.assertIsInstance(self.img.data[3][5], float)
+        self.assertEqual(self.img.data[3][5], float(self.img.pixels[3, 5]))
+
+        self.img.data[3][5] = 255
+        self.assertEqual(self.img.pixels[3, 5], 255)
+        self.assertEqual(self.img.data[3].count(255), int(np.count_nonzero(self.img.pixels[3] == 255)))
+
+    def test_data_view_compares_to_lists(self):
+        as_lists = [list(row) for row in self.img.data]
+        self.assertEqual(as_lists, self.img.data)
+        self.assertEqual(self.img.data[0][:10], as_lists[0][:10])
+
+    def test_assigning_lists_keeps_array_storage(self):
+        self.img.data = [[1, 2, 3], [4, 5, 6]]
+        self.assertEqual(self.img.pixels.shape, (2, 3))
+        self.assertEqual(self.img.pixels.dtype, np.float32)
+
+    def test_pixels_argument_is_copied(self):
+        for dtype in (np.float32, np.uint8):
+            source = self.img.pixels.astype(dtype)
+            original = source.copy()
+            img = Img('noisy.png', dtype=dtype, pixels=source)
+            img.salt_n_pepper(seed=0)
+            np.testing.assert_array_equal(source, original)
+
+    def test_encoded_roundtrip(self):
+        with open(img_path, 'rb') as f:
+            img = Img('photo.jpeg', encoded=f.read())
+
+        np.testing.assert_array_equal(img.pixels, self.img.pixels)
+
+        decoded = Img('filtered.jpeg', encoded=img.encode())
+        self.assertEqual(decoded.pixels.shape, img.pixels.shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import tempfile
+from polybot.result_cache import ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.disk_dir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(max_memory_bytes=10, disk_dir=self.disk_dir.name, max_disk_bytes=20)
+
+    def tearDown(self):
+        self.disk_dir.cleanup()
+
+    def test_key_depends_on_operation_and_params(self):
+        keys = {ResultCache.key('photo', 'blur'), ResultCache.key('photo', 'contour'),
+                ResultCache.key('photo', 'blur', 8), ResultCache.key('other', 'blur')}
+        self.assertEqual(len(keys), 4)
+
+    def test_hit_and_miss_counters(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('a', b'1234')
+        self.assertEqual(self.cache.get('a'), b'1234')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_memory_lru_eviction(self):
+        self.cache.put('a', b'1234')
+        self.cache.put('b', b'1234')
+        self.cache.get('a')
+        self.cache.put('c', b'1234')
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['memory_entries'], 2)
+        self.assertLessEqual(stats['memory_bytes'], 10)
+        self.assertNotIn('b', self.cache._memory)
+
+    def test_disk_tier(self):
+        for key in 'abcdef':
+            self.cache.put(key, b'12345')
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['disk_entries'], 4)
+        self.assertLessEqual(stats['disk_bytes'], 20)
+
+        # 'c' was evicted from memory but is still on disk, and survives a restart
+        restarted = ResultCache(max_memory_bytes=10, disk_dir=self.disk_dir.name, max_disk_bytes=20)
+        self.assertEqual(restarted.get('c'), b'12345')
+        self.assertIsNone(restarted.get('a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
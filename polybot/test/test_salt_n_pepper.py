@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 from polybot.img_proc import Img
 import os
 
@@ -37,5 +38,28 @@ class TestImgConcat(unittest.TestCase):
         self.assertGreaterEqual(untouched_pixel_percentage, 0.70)
 
 
+class TestSaltNPepperSeed(unittest.TestCase):
+
+    def test_same_seed_same_noise(self):
+        img = Img(img_path)
+        other_img = Img(img_path)
+
+        img.salt_n_pepper(seed=7)
+        other_img.salt_n_pepper(seed=7)
+
+        np.testing.assert_array_equal(img.pixels, other_img.pixels)
+
+    def test_noise_probabilities(self):
+        img = Img(img_path)
+        img.pixels[:] = 128
+        amount = 0.2
+
+        img.salt_n_pepper(amount, seed=np.random.default_rng(3))
+
+        # Salt comes from the first draw, pepper from the second draw of the remaining pixels
+        self.assertAlmostEqual(np.mean(img.pixels == 0), amount, delta=0.01)
+        self.assertAlmostEqual(np.mean(img.pixels == 255), (1 - amount) * amount, delta=0.01)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,12 @@
 import unittest
 from unittest.mock import patch, Mock
 from polybot.bot import ImageProcessingBot
+from polybot import img_proc
+from polybot.img_codecs import PILCodec
+from polybot.img_tiles import TiledImg
+from polybot.jobs import JobScheduler
 import os
+import tempfile
 
 img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
 
@@ -62,15 +67,217 @@ class TestBot(unittest.TestCase):
 
         self.bot = bot
 
+    def test_webhook_is_set_on_start(self):
+        self.bot.telegram_bot_client.set_webhook.assert_not_called()
+        self.assertFalse(self.bot.started)
+
+        self.bot.start()
+        self.bot.telegram_bot_client.set_webhook.assert_called_once_with(url='webhook_url/bot_token/', timeout=60)
+        self.assertTrue(self.bot.started)
+
     def test_contour(self):
         mock_msg['caption'] = 'Contour'
 
         with patch('polybot.img_proc.Img.contour') as mock_method:
             self.bot.handle_message(mock_msg)
+            self.bot.scheduler.join()
+
+            mock_method.assert_called_once()
+            self.bot.telegram_bot_client.send_photo.assert_called_once()
+
+    def test_salt_and_pepper(self):
+        mock_msg['caption'] = 'Salt and pepper'
+
+        with patch('polybot.img_proc.Img.salt_n_pepper') as mock_method:
+            self.bot.handle_message(mock_msg)
+            self.bot.scheduler.join()
 
             mock_method.assert_called_once()
             self.bot.telegram_bot_client.send_photo.assert_called_once()
 
+    def test_multi_step_caption(self):
+        mock_msg['caption'] = 'Rotate, contour -> blur'
+
+        with patch.object(PILCodec, 'decode', autospec=True, side_effect=PILCodec.decode) as mock_decode:
+            self.bot.handle_message(mock_msg)
+            self.bot.scheduler.join()
+
+            mock_decode.assert_called_once()
+            self.bot.telegram_bot_client.get_file.assert_called_once()
+            self.bot.telegram_bot_client.send_photo.assert_called_once()
+
+    def test_caption_with_separators_but_no_chain(self):
+        # Not every part is a filter: the caption is matched as a whole, as single filter captions are
+        for caption, method in (('Please, blur', 'blur'), ('rotate it, thanks', 'rotate'),
+                                ('Rotate, emboss', 'rotate'), ('blur then send it back', 'blur')):
+            mock_msg['caption'] = caption
+            with patch(f'polybot.img_proc.Img.{method}', autospec=True) as mock_method, \
+                    patch.object(self.bot.result_cache, 'get', return_value=None):
+                self.bot.handle_message(mock_msg)
+                self.bot.scheduler.join()
+
+                mock_method.assert_called_once()
+
+        self.bot.telegram_bot_client.send_message.assert_not_called()
+
+    def test_unknown_caption(self):
+        mock_msg['caption'] = 'Emboss, please'
+
+        self.bot.handle_message(mock_msg)
+        self.bot.scheduler.join()
+
+        self.bot.telegram_bot_client.send_photo.assert_not_called()
+        self.bot.telegram_bot_client.send_message.assert_called_once()
+
+    def test_result_cache_hit(self):
+        mock_msg['caption'] = 'Blur'
+
+        self.bot.handle_message(mock_msg)
+        self.bot.scheduler.join()
+        self.bot.handle_message(mock_msg)
+        self.bot.scheduler.join()
+
+        self.bot.telegram_bot_client.get_file.assert_called_once()
+        self.assertEqual(self.bot.telegram_bot_client.send_photo.call_count, 2)
+        self.assertEqual((self.bot.result_cache.hits, self.bot.result_cache.misses), (1, 1))
+
+    def test_random_filters_are_not_cached(self):
+        for caption in ('Salt and pepper', 'blur, salt and pepper'):
+            self.bot.telegram_bot_client.reset_mock()
+            mock_msg['caption'] = caption
+
+            for _ in range(2):
+                self.bot.handle_message(mock_msg)
+                self.bot.scheduler.join()
+
+            self.assertEqual(self.bot.telegram_bot_client.get_file.call_count, 2, caption)
+            self.assertEqual(self.bot.telegram_bot_client.send_photo.call_count, 2, caption)
+        self.assertEqual(self.bot.result_cache.hits, 0)
+
+    def test_result_cache_key_settings(self):
+        # Results made under another size cap or codec are not served
+        key = self.bot.result_cache_key('AQADAb8xG8e94FF9', 'blur')
+        with patch('polybot.bot.MAX_IMAGE_DIMENSION', 256):
+            self.assertNotEqual(self.bot.result_cache_key('AQADAb8xG8e94FF9', 'blur'), key)
+        with patch.dict(os.environ, {'IMAGE_CODEC': 'matplotlib'}):
+            self.assertNotEqual(self.bot.result_cache_key('AQADAb8xG8e94FF9', 'blur'), key)
+        self.assertEqual(self.bot.result_cache_key('AQADAb8xG8e94FF9', 'blur'), key)
+
+    def test_queue_full(self):
+        mock_msg['caption'] = 'Blur'
+        self.bot.scheduler = JobScheduler(workers=0, max_queued=1)
+
+        self.bot.handle_message(mock_msg)
+        self.bot.handle_message(mock_msg)
+
+        texts = [call.args[1] for call in self.bot.telegram_bot_client.send_message.call_args_list]
+        self.assertEqual(texts, ['Queued, position 1', 'The bot is busy right now, please try again in a minute.'])
+
+    def test_in_memory_processing(self):
+        mock_msg['caption'] = 'Rotate'
+
+        with patch.object(self.bot, 'download_user_photo') as mock_download, \
+                patch('polybot.img_proc.Img.save_img') as mock_save:
+            self.bot.handle_message(mock_msg)
+            self.bot.scheduler.join()
+
+            mock_download.assert_not_called()
+            mock_save.assert_not_called()
+            self.bot.telegram_bot_client.send_photo.assert_called_once()
+
+    def test_save_to_disk_for_debugging(self):
+        mock_msg['caption'] = 'Rotate'
+        self.bot.save_to_disk = True
+
+        # The photo is saved under the working directory, keep it away from the test fixtures
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            os.chdir(scratch_dir)
+            try:
+                self.bot.handle_message(mock_msg)
+                self.bot.scheduler.join()
+            finally:
+                os.chdir(cwd)
+
+            self.assertTrue(os.path.exists(os.path.join(scratch_dir, 'photos/beatles.jpeg')))
+            self.assertTrue(os.path.exists(os.path.join(scratch_dir, 'photos/beatles_filtered.jpeg')))
+            self.bot.telegram_bot_client.send_photo.assert_called_once()
+
+    def test_tiled_image_is_closed(self):
+        mock_msg['caption'] = 'Blur'
+
+        with patch('polybot.bot.TILED_PROCESSING_MIN_PIXELS', 1), \
+                patch('polybot.img_tiles.TiledImg.close', autospec=True, side_effect=TiledImg.close) as mock_close:
+            self.bot.handle_message(mock_msg)
+            self.bot.scheduler.join()
+
+            mock_close.assert_called_once()
+            self.bot.telegram_bot_client.send_photo.assert_called_once()
+
+    def test_large_photo_filters(self):
+        # Only the filters TiledImg implements may get one, the others process large photos in memory
+        with patch('polybot.bot.TILED_PROCESSING_MIN_PIXELS', 1):
+            for caption in ('Rotate', 'Segment', 'Salt and pepper', 'Blur', 'Contour', 'Sobel'):
+                self.bot.telegram_bot_client.reset_mock()
+                mock_msg['caption'] = caption
+
+                self.bot.handle_message(mock_msg)
+                self.bot.scheduler.join()
+
+                sent = (self.bot.telegram_bot_client.send_photo.call_count +
+                        self.bot.telegram_bot_client.send_media_group.call_count)
+                self.assertEqual(sent, 1, caption)
+
+    def test_segment_album(self):
+        mock_msg['caption'] = 'Segment'
+
+        self.bot.handle_message(mock_msg)
+        self.bot.scheduler.join()
+        self.bot.handle_message(mock_msg)
+        self.bot.scheduler.join()
+
+        self.bot.telegram_bot_client.send_photo.assert_not_called()
+        self.assertEqual(self.bot.telegram_bot_client.send_media_group.call_count, 2)
+        chat_id, media = self.bot.telegram_bot_client.send_media_group.call_args.args
+        self.assertEqual(chat_id, mock_msg['chat']['id'])
+        self.assertEqual(len(media), 4)
+        self.bot.telegram_bot_client.get_file.assert_called_once()
+
+    def test_concat_album(self):
+        album = [dict(mock_msg, message_id=350, media_group_id='album'),
+                 dict(mock_msg, message_id=351, media_group_id='album', caption='Concat')]
+        del album[0]['caption']
+
+        for msg in album:
+            self.bot.handle_message(msg)
+        self.bot.media_groups.flush()
+        self.bot.scheduler.join()
+
+        self.assertEqual(self.bot.telegram_bot_client.get_file.call_count, 2)
+        self.bot.telegram_bot_client.send_photo.assert_called_once()
+
+        sent_file = self.bot.telegram_bot_client.send_photo.call_args.args[1].file
+        concatenated = img_proc.Img('concat.jpeg', encoded=sent_file.getvalue())
+        original = img_proc.Img(img_path)
+        self.assertEqual(concatenated.pixels.shape, (original.pixels.shape[0], 2 * original.pixels.shape[1]))
+
+    def test_concat_album_of_three(self):
+        # No photo is lost or cropped to a narrower one
+        album = [dict(mock_msg, message_id=message_id, media_group_id='album') for message_id in (350, 351, 352)]
+        for msg in album:
+            del msg['caption']
+        album[2]['caption'] = 'Concat'
+
+        for msg in album:
+            self.bot.handle_message(msg)
+        self.bot.media_groups.flush()
+        self.bot.scheduler.join()
+
+        self.assertEqual(self.bot.telegram_bot_client.get_file.call_count, 3)
+        sent_file = self.bot.telegram_bot_client.send_photo.call_args.args[1].file
+        concatenated = img_proc.Img('concat.jpeg', encoded=sent_file.getvalue())
+        original = img_proc.Img(img_path)
+        self.assertEqual(concatenated.pixels.shape, (original.pixels.shape[0], 3 * original.pixels.shape[1]))
 
 
 if __name__ == '__main__':
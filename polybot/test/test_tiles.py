@@ -0,0 +1,105 @@
+import unittest
+from pathlib import Path
+import io
+import subprocess
+import sys
+import tempfile
+import numpy as np
+from PIL import Image
+from polybot.img_codecs import UnsupportedFormat
+from polybot.img_proc import Img
+from polybot.img_tiles import TiledImg
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+class TestTiledImg(unittest.TestCase):
+
+    def setUp(self):
+        self.tiled_img = TiledImg(img_path, tile_rows=50)
+
+        # Reference: the same decoded pixels, processed as a single in-memory Img
+        self.img = Img(img_path)
+        self.img.data = np.array(self.tiled_img.pixels)
+
+    def tearDown(self):
+        self.tiled_img.close()
+
+    def test_pixels_are_memory_mapped(self):
+        self.assertIsInstance(self.tiled_img.pixels, np.memmap)
+
+    def test_blur_matches_in_memory(self):
+        self.tiled_img.blur(16)
+        self.img.blur(16)
+        np.testing.assert_array_equal(self.tiled_img.pixels, self.img.pixels)
+
+    def test_contour_matches_in_memory(self):
+        self.tiled_img.contour()
+        self.img.contour()
+        np.testing.assert_array_equal(self.tiled_img.pixels, self.img.pixels)
+
+    def test_save_img(self):
+        self.tiled_img.blur(3)
+        self.tiled_img.contour()
+        self.tiled_img.path = self.tiled_img.path.with_name('tiles.jpeg')
+        new_path = self.tiled_img.save_img()
+
+        try:
+            self.assertTrue(new_path.exists())
+            self.assertEqual(Img(new_path).pixels.shape, self.tiled_img.pixels.shape)
+        finally:
+            new_path.unlink()
+
+    def test_other_formats_are_rejected(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 48)).save(buffer, 'PNG')
+        with self.assertRaises(UnsupportedFormat):
+            TiledImg('document.png', encoded=buffer.getvalue())
+
+
+# Blurs, contours and encodes a JPEG in a fresh interpreter, printing the peak resident memory it added
+MEMORY_PROBE = """
+import sys
+from polybot.img_tiles import TiledImg
+
+def status(key):
+    with open('/proc/self/status') as status_file:
+        return next(int(line.split()[1]) * 1024 for line in status_file if line.startswith(key + ':'))
+
+baseline = status('VmRSS')
+with TiledImg(sys.argv[1], tile_rows=int(sys.argv[2])) as img:
+    img.blur()
+    img.contour()
+    img.encode()
+print(status('VmHWM') - baseline)
+"""
+
+
+@unittest.skipUnless(os.path.exists('/proc/self/status'), 'reads VmHWM from /proc')
+class TestTiledMemory(unittest.TestCase):
+
+    def test_peak_memory_is_bounded_by_tiles(self):
+        height, width, tile_rows = 3000, 4000, 64
+        root = Path(__file__).resolve().parents[2]
+        rng = np.random.default_rng(0)
+        gray = (np.add.outer(np.arange(height), np.arange(width)) * (255 / (height + width)) +
+                rng.normal(0, 8, (height, width))).clip(0, 255).astype(np.uint8)
+
+        with tempfile.TemporaryDirectory() as workdir:
+            photo = Path(workdir) / 'large.jpeg'
+            Image.fromarray(np.stack([gray, gray[::-1], gray[:, ::-1]], axis=-1)).save(photo, quality=90)
+            del gray
+            output = subprocess.run([sys.executable, '-c', MEMORY_PROBE, str(photo), str(tile_rows)], cwd=root,
+                                    capture_output=True, text=True, check=True).stdout
+        peak_memory = int(output.split()[-1])
+
+        # The luma decode and the encoder's levels (a byte per pixel each, not at once) and the compressed
+        # output, plus a few float32 bands: far below a single float32 copy of the image
+        band_bytes = tile_rows * width * 4
+        self.assertLess(peak_memory, 2.5 * height * width + 8 * band_bytes)
+        self.assertLess(peak_memory, 4 * height * width)
+
+
+if __name__ == '__main__':
+    unittest.main()
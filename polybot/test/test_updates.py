@@ -0,0 +1,88 @@
+import unittest
+import threading
+import time
+from polybot.updates import UpdateDispatcher, update_chat_id
+
+
+def message(update_id, chat_id):
+    return {'update_id': update_id, 'message': {'message_id': update_id, 'chat': {'id': chat_id}}}
+
+
+class TestUpdateDispatcher(unittest.TestCase):
+
+    def test_redelivered_updates_are_ignored(self):
+        handled = []
+        dispatcher = UpdateDispatcher(handled.append, workers=2)
+
+        self.assertTrue(dispatcher.dispatch({'update_id': 1}))
+        self.assertFalse(dispatcher.dispatch({'update_id': 1}))
+        self.assertTrue(dispatcher.dispatch({'update_id': 2}))
+        dispatcher.shutdown()
+
+        self.assertEqual(sorted(u['update_id'] for u in handled), [1, 2])
+        self.assertEqual(dispatcher.duplicates, 1)
+
+    def test_dispatch_does_not_wait_for_handler(self):
+        release = threading.Event()
+        handled = []
+        dispatcher = UpdateDispatcher(lambda update: (release.wait(5), handled.append(update)))
+
+        dispatcher.dispatch({'update_id': 1})
+        self.assertEqual(handled, [])
+        self.assertEqual(dispatcher.pending(), 1)
+
+        # Shutdown drains the in-flight update
+        release.set()
+        dispatcher.shutdown()
+        self.assertEqual(dispatcher.pending(), 0)
+        self.assertEqual(handled, [{'update_id': 1}])
+
+    def test_remembered_updates_are_bounded(self):
+        dispatcher = UpdateDispatcher(lambda update: None, remembered_updates=2)
+        for update_id in (1, 2, 3):
+            dispatcher.dispatch({'update_id': update_id})
+
+        self.assertTrue(dispatcher.dispatch({'update_id': 1}))
+        dispatcher.shutdown()
+
+    def test_updates_of_a_chat_keep_their_order(self):
+        handled = []
+
+        def handle(update):
+            # The first update of the chat is the slowest, a free worker must not overtake it
+            if update['update_id'] == 1:
+                time.sleep(0.1)
+            handled.append(update['update_id'])
+
+        dispatcher = UpdateDispatcher(handle, workers=4)
+        for update_id in (1, 2, 3):
+            dispatcher.dispatch(message(update_id, chat_id=7))
+        dispatcher.shutdown()
+
+        self.assertEqual(handled, [1, 2, 3])
+
+    def test_chats_are_handled_in_parallel(self):
+        release = threading.Event()
+        handled = []
+        dispatcher = UpdateDispatcher(lambda update: (update['update_id'] == 1 and release.wait(5),
+                                                      handled.append(update['update_id'])), workers=2)
+
+        dispatcher.dispatch(message(1, chat_id=7))
+        dispatcher.dispatch(message(2, chat_id=8))
+        deadline = time.monotonic() + 5
+        while handled != [2] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(handled, [2])
+
+        release.set()
+        dispatcher.shutdown()
+        self.assertEqual(handled, [2, 1])
+
+    def test_update_chat_id(self):
+        self.assertEqual(update_chat_id(message(1, chat_id=7)), 7)
+        self.assertEqual(update_chat_id({'update_id': 1, 'callback_query': {'message': {'chat': {'id': 8}}}}), 8)
+        self.assertIsNone(update_chat_id({'update_id': 1, 'poll': {'id': '5'}}))
+
+
+if __name__ == '__main__':
+    unittest.main()
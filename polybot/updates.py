@@ -0,0 +1,92 @@
+"""
+Background dispatch of Telegram webhook updates.
+
+The webhook only hands the update over and answers Telegram right away; the update is handled
+on a thread pool. The updates of a chat are handled one at a time in the order they arrived (the
+second photo of a user is not processed before the first), those of different chats in parallel.
+Telegram redelivers updates it did not get an answer for in time, so updates are deduplicated by
+`update_id`.
+"""
+from collections import OrderedDict
+import threading
+from loguru import logger
+from polybot.jobs import JobScheduler
+
+DEFAULT_WORKERS = 4
+# How many recent update ids are remembered for deduplication
+DEFAULT_REMEMBERED_UPDATES = 10000
+
+
+def update_chat_id(update):
+    """
+    Id of the chat `update` (a message, an edited message, a callback query, ...) belongs to, or None
+    """
+    for value in update.values():
+        if isinstance(value, dict):
+            chat = value.get('chat') or value.get('message', {}).get('chat')
+            if chat:
+                return chat.get('id')
+    return None
+
+
+class UpdateDispatcher:
+
+    def __init__(self, handler, workers=DEFAULT_WORKERS, remembered_updates=DEFAULT_REMEMBERED_UPDATES):
+        """
+        `handler` is called with each (new) update, on one of `workers` background threads,
+        after the updates of the same chat dispatched before it
+        """
+        self.handler = handler
+        self.remembered_updates = remembered_updates
+        self.duplicates = 0
+        self._pending = 0
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        # Updates are never dropped: Telegram was already answered, it would not redeliver them
+        self._scheduler = JobScheduler(workers=workers, max_queued=float('inf'))
+
+    def dispatch(self, update):
+        """
+        Schedules `update` for handling. Returns False (and does nothing) if it was seen before.
+        """
+        update_id = update.get('update_id')
+
+        with self._lock:
+            if update_id is not None:
+                if update_id in self._seen:
+                    self.duplicates += 1
+                    logger.info(f'Ignoring redelivered update {update_id}')
+                    return False
+
+                self._seen[update_id] = None
+                if len(self._seen) > self.remembered_updates:
+                    self._seen.popitem(last=False)
+            self._pending += 1
+
+        # Updates without a chat have nothing to be ordered with, they get a key of their own
+        chat_id = update_chat_id(update)
+        key = ('chat', chat_id) if chat_id is not None else object()
+        self._scheduler.submit(key, lambda: self._handle(update))
+        return True
+
+    def _handle(self, update):
+        try:
+            self.handler(update)
+        except Exception:
+            logger.exception(f'Failed handling update {update.get("update_id")}')
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def pending(self):
+        """
+        Number of updates dispatched and not handled yet
+        """
+        with self._lock:
+            return self._pending
+
+    def shutdown(self, wait=True):
+        """
+        Stops accepting updates, and (with `wait`) blocks until the in-flight ones are handled
+        """
+        self._scheduler.shutdown(wait=wait)
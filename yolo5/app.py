@@ -1,33 +1,136 @@
+import atexit
+import functools
+import signal
+import sys
+import threading
 import time
-from pathlib import Path
-from flask import Flask, request
-from detect import run
+from flask import Flask, Response, abort, request
+from engine import InferenceEngine, decode_image, image_format
+from batching import MicroBatcher
+from transfer import S3Transfer, make_client
+from summary_writer import BufferFull, BulkWriter
+from prediction_cache import PredictionCache
+try:
+    # polybot/metrics.py, copied next to this file in the image (see Dockerfile)
+    from metrics import metrics
+except ImportError:
+    # Run from a checkout, with the repository root on the path
+    from polybot.metrics import metrics
 import uuid
-import yaml
 from loguru import logger
 import os
-import boto3
-from pymongo import MongoClient
 import subprocess
 
 # Load environment variable
 images_bucket = os.environ['BUCKET_NAME']
 
-# Initialize S3 client
-s3 = boto3.client('s3')
+# The S3 and Mongo clients (and the modules behind them) are created on first use, or by the warm-up
+# at startup, so the service answers health checks right away
+_init_lock = threading.RLock()
+# Set once the model is loaded and the clients are created
+ready_event = threading.Event()
 
-# Initialize the MongoDB client (replace with your MongoDB connection details)
-mongo_client = MongoClient('mongodb://localhost:27017/')
-db = mongo_client['mongosh'] #your_database_name
-collection = db['myReplicaSet'] #your_collection_name
 
-# Load object detection model class names from coco128.yaml
-with open("data/coco128.yaml", "r") as stream:
-    names = yaml.safe_load(stream)['names']
+def lazy(factory):
+    """
+    Defers `factory` to the first call of the returned getter (thread-safe), which then keeps returning its result
+    """
+    instance = []
+
+    @functools.wraps(factory)
+    def get():
+        if not instance:
+            with _init_lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    get.initialized = lambda: bool(instance)
+    return get
+
+
+@lazy
+def get_transfer():
+    # One S3 client, and connection pool, shared by all requests. Annotated images are uploaded in the background
+    s3 = make_client(max_pool_connections=int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 32)))
+    return S3Transfer(s3, images_bucket, upload_workers=int(os.environ.get('S3_UPLOAD_WORKERS', 8)))
+
+
+@lazy
+def get_collection():
+    from pymongo import MongoClient
+
+    # Initialize the MongoDB client (replace with your MongoDB connection details)
+    mongo_client = MongoClient('mongodb://localhost:27017/')
+    db = mongo_client['mongosh'] #your_database_name
+    return db['myReplicaSet'] #your_collection_name
+
+
+@lazy
+def get_summaries():
+    # Prediction summaries are written in the background, batched into insert_many calls
+    return BulkWriter(get_collection(),
+                      batch_size=int(os.environ.get('MONGO_BATCH_SIZE', 100)),
+                      flush_interval=float(os.environ.get('MONGO_FLUSH_INTERVAL', 1.0)),
+                      max_buffered=int(os.environ.get('MONGO_MAX_BUFFERED', 10000)),
+                      on_batch=lambda size, seconds: metrics.observe('mongo_write', seconds))
+
+
+@lazy
+def get_prediction_cache():
+    # Predictions of images already seen (by ETag) with the current model: in-process LRU, then the summaries in Mongo
+    cache = PredictionCache(get_collection(), max_entries=int(os.environ.get('PREDICTION_CACHE_ENTRIES', 1024)))
+    try:
+        cache.ensure_index()
+    except Exception:
+        logger.exception('Creating the prediction cache index failed')
+    return cache
+
+
+# The model is loaded once (by the warm-up, see below) and shared by all requests
+engine = InferenceEngine(weights=os.environ.get('YOLO_WEIGHTS', 'yolov5s.pt'))
+
+# Concurrent requests are gathered into one batched forward pass: whatever arrives within the window
+# (in milliseconds) after the first waiting request, up to the max batch size
+def predict_batch(images):
+    with metrics.span('model'):
+        return engine.predict(images)
+
+
+batcher = MicroBatcher(predict_batch,
+                       max_batch_size=int(os.environ.get('MAX_BATCH_SIZE', 8)),
+                       window=float(os.environ.get('BATCH_WINDOW_MS', 10)) / 1000)
 
 # Initialize Flask app
 app = Flask(__name__)
 
+
+@app.route('/', methods=['GET'])
+def index():
+    # Liveness: answers as soon as the process serves HTTP
+    return 'Ok'
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    # Readiness: the model is loaded and warm, the S3 and Mongo clients are created
+    status = {
+        'model': engine.loaded,
+        's3': get_transfer.initialized(),
+        'mongo': get_summaries.initialized() and get_prediction_cache.initialized(),
+    }
+    return status, 200 if ready_event.is_set() else 503
+
+
+def store_summary(prediction_id, prediction_summary):
+    # Stores the prediction_summary in MongoDB, waiting a bounded time for room in the write buffer
+    try:
+        with metrics.span('summary_queue', prediction_id):
+            get_summaries().write(prediction_summary, timeout=float(os.environ.get('MONGO_WRITE_TIMEOUT', 5)))
+    except BufferFull:
+        logger.error(f'prediction: {prediction_id}. summary not stored, write buffer full')
+
+
 @app.route('/predict', methods=['POST'])
 def predict():
     # Generates a UUID for this current prediction HTTP request. This id can be used as a reference in logs to
@@ -39,79 +142,156 @@ def predict():
     # Receives a URL parameter representing the image to download from S3
     img_name = request.args.get('imgName')
 
-    # TODO download img_name from S3, store the local image path in original_img_path
-    # Specify the key (path) of the image within the bucket
-    filename = img_name.split('/')[-1]
-    local_dir = 'photos/'
-    os.makedirs(local_dir, exist_ok=True)
-    original_img_path = local_dir + filename
-    s3.download_file(images_bucket, img_name, original_img_path)
-
-    # Download the image from S3 to a local directory
-    local_image_path = f'temporary_folder/{img_name}'  # Update the path accordingly
-    s3.download_file(images_bucket, s3_image_key, local_image_path)
-
-    logger.info(f'prediction id: {prediction_id}, path: \"{original_img_path}\" Download img completed')
-
-    # Predicts the objects in the image
-    run(
-        weights='yolov5s.pt',
-        data='data/coco128.yaml',
-        source=local_image_path,
-        project='static/data',
-        name=prediction_id,
-        save_txt=True
-    )
-
-    logger.info(f'prediction: {prediction_id}, path: {original_img_path}. done')
-
-    # This is the path for the predicted image with labels
-    predicted_img_path = Path(f'static/data/{prediction_id}/{filename}')
-
-    # TODO Uploads the predicted image (predicted_img_path) to S3 (be careful not to override the original image).
-    predicted_img_path = Path(f'static/data/{prediction_id}/{filename}')
-    predicted_img_name = f'predicted_{filename}'
-    os.rename(f'/usr/src/app/static/data/{prediction_id}/{filename}',
-              f'/usr/src/app/static/data/{prediction_id}/{predicted_img_name}')
-    s3_path_to_upload_to = '/'.join(img_name.split('/')[:-1]) + f'/{predicted_img_name}'
-    file_to_upload = f'/usr/src/app/static/data/{prediction_id}/{predicted_img_name}'
-    s3.upload_file(file_to_upload, images_bucket, s3_path_to_upload_to)
-    os.rename(f'/usr/src/app/static/data/{prediction_id}/{predicted_img_name}',
-              f'/usr/src/app/static/data/{prediction_id}/{filename}')
-
-    logger.info(f'prediction: {prediction_id}/{local_image_path}. Image uploaded to S3.')
-
-    # Parse prediction labels and create a summary
-    pared_summary_path = Path(f'static/data/{prediction_id}/labels/{original_img_path.split(".")[0]}.txt')
-    if pared_summary_path.exists():
-        with open(pared_summary_path) as f:
-            labels = f.read().splitlines()
-            labels = [line.split(' ') for line in labels]
-            labels = [{
-                'class': names[int(l[0])],
-                'cx': float(l[1]),
-                'cy': float(l[2]),
-                'width': float(l[3]),
-                'height': float(l[4]),
-            } for l in labels]
-
-        logger.info(f'prediction: {prediction_id}/{original_img_path}. prediction summary:\n\n{labels}')
-
-        prediction_summary = {
+    # The same image (same ETag) predicted by the same model is answered from the cache
+    with metrics.span('cache_lookup', prediction_id):
+        etag, size = get_transfer().head(img_name)
+        cache_key = PredictionCache.key(etag, engine.version)
+        cached = get_prediction_cache().get(cache_key)
+    if cached is not None:
+        logger.info(f'prediction: {prediction_id}, image: {img_name}. cache hit')
+        return {
             'prediction_id': prediction_id,
-            'original_img_path': local_image_path,
-            'predicted_img_path': predicted_img_path,
-            'labels': labels,
-            'time': time.time()
+            'original_img_path': img_name,
+            'predicted_img_path': cached['predicted_img_path'],
+            'labels': cached['labels'],
+            'time': time.time(),
+            'cached': True,
         }
 
-        # TODO store the prediction_summary in MongoDB
-        collection.insert_one(prediction_summary)
+    # Reads the image from S3 straight into memory
+    filename = img_name.split('/')[-1]
+    with metrics.span('s3_download', prediction_id):
+        data = get_transfer().download(img_name, size)
+    with metrics.span('decode', prediction_id):
+        image = decode_image(data)
+
+    logger.info(f'prediction id: {prediction_id}, image: \"{img_name}\" Download img completed')
 
-        return prediction_summary
-    else:
-        return f'prediction: {prediction_id}/{local_image_path}. prediction result not found', 404
+    # Predicts the objects in the image, with the resident model (batched with concurrent requests)
+    with metrics.span('inference', prediction_id):
+        prediction = batcher.submit(image)
+
+    logger.info(f'prediction: {prediction_id}, image: {img_name}. done')
+
+    # Uploads the annotated image next to the original one, in the background (see /uploads/<prediction_id>)
+    predicted_img_name = f'predicted_{filename}'
+    predicted_img_key = img_name[:-len(filename)] + predicted_img_name
+    with metrics.span('encode', prediction_id):
+        encoded = prediction.encode(image_format(filename))
+    upload_start = time.perf_counter()
+    upload = get_transfer().upload_async(prediction_id, predicted_img_key, encoded)
+    upload.add_done_callback(
+        lambda future: metrics.observe('s3_upload', time.perf_counter() - upload_start, prediction_id))
+
+    labels = [{key: label[key] for key in ('class', 'cx', 'cy', 'width', 'height')} for label in prediction.labels]
+    logger.info(f'prediction: {prediction_id}/{img_name}. prediction summary:\n\n{labels}')
+
+    prediction_summary = {
+        'prediction_id': prediction_id,
+        'original_img_path': img_name,
+        'predicted_img_path': predicted_img_key,
+        'labels': labels,
+        'time': time.time(),
+        'cache_key': cache_key,
+    }
+    # Cached and stored once the annotated image is in S3, see PredictionCache.put_when_uploaded
+    get_prediction_cache().put_when_uploaded(cache_key, prediction_summary, upload,
+                                             lambda summary: store_summary(prediction_id, summary))
+
+    return prediction_summary
+
+
+@app.route('/uploads/<prediction_id>', methods=['GET'])
+def upload_status(prediction_id):
+    status = get_transfer().upload_status(prediction_id)
+    if status is None:
+        return f'prediction: {prediction_id}. no upload found', 404
+    return {'prediction_id': prediction_id, 'status': status}
+
+
+@app.route('/stats/batching', methods=['GET'])
+def batching_stats():
+    return batcher.stats()
+
+
+@app.route('/stats/summaries', methods=['GET'])
+def summaries_stats():
+    return get_summaries().stats()
+
+
+@app.route('/stats/prediction_cache', methods=['GET'])
+def prediction_cache_stats():
+    return get_prediction_cache().stats()
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/metrics/trace/<prediction_id>', methods=['GET'])
+def get_trace(prediction_id):
+    if not metrics.allows_debug(request.headers.get('X-Debug-Token')):
+        abort(404)
+    return {'prediction_id': prediction_id, 'spans': metrics.trace(prediction_id)}
+
+
+@app.route('/metrics/profiler', methods=['GET', 'POST'])
+def profiler():
+    # POST ?enabled=1[&interval=0.01] starts sampling, ?enabled=0 stops it; GET returns the collapsed stacks.
+    # Only requests with the X-Debug-Token header (see METRICS_DEBUG_TOKEN) get here
+    if not metrics.allows_debug(request.headers.get('X-Debug-Token')):
+        abort(404)
+    if request.method == 'POST':
+        if request.args.get('enabled', '1').lower() in ('1', 'true', 'yes'):
+            metrics.start_profiler(float(request.args.get('interval', 0.01)))
+        else:
+            metrics.stop_profiler()
+        return 'Ok'
+
+    if metrics.profiler is None:
+        return 'Profiler was never started', 404
+    return Response(metrics.profiler.collapsed(int(request.args.get('top', 100))), mimetype='text/plain')
+
+
+# Gauges of components not created yet read 0, reading them does not create them
+metrics.gauge('batch_queue_depth', lambda: batcher.stats()['queued'])
+metrics.gauge('summaries_buffered', lambda: get_summaries().stats()['buffered'] if get_summaries.initialized() else 0)
+metrics.counter('summaries_failed_total', lambda: get_summaries().stats()['failed'] if get_summaries.initialized() else 0)
+metrics.gauge('uploads_pending', lambda: get_transfer().pending_uploads() if get_transfer.initialized() else 0)
+
+
+def warm_up():
+    # Model loading and client creation, in the background while / already answers. Retried until it succeeds.
+    while True:
+        try:
+            engine.load()
+            # Hashes the weights file now, not in the first request
+            model_version = engine.version
+            get_transfer()
+            get_summaries()
+            get_prediction_cache()
+            ready_event.set()
+            logger.info(f'Ready, model {model_version}')
+            return
+        except Exception:
+            logger.exception('Warm-up failed, retrying in 5 seconds')
+            time.sleep(5)
+
+
+def shutdown():
+    # Pending uploads and buffered summaries are finished before the process exits
+    if get_transfer.initialized():
+        get_transfer().shutdown(wait=True)
+    if get_summaries.initialized():
+        get_summaries().close()
 
 
 if __name__ == "__main__":
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+    if os.environ.get('PROFILER_ENABLED', '').lower() in ('1', 'true', 'yes'):
+        metrics.start_profiler()
+    atexit.register(shutdown)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
     app.run(host='0.0.0.0', port=8081)
@@ -0,0 +1,120 @@
+"""
+Dynamic micro-batching in front of the model.
+
+Concurrent requests submit one item each. A scheduler thread gathers the items that arrive within
+`window` seconds of the first one (or until `max_batch_size` items are waiting), runs them through
+the model as one batch, and hands each request its own result back.
+"""
+from collections import deque
+from concurrent.futures import Future
+import threading
+import time
+import numpy as np
+from loguru import logger
+
+DEFAULT_MAX_BATCH_SIZE = 8
+DEFAULT_WINDOW = 0.01
+# Number of recent requests / batches the statistics are computed over
+STATS_HISTORY = 1000
+
+
+class MicroBatcher:
+
+    def __init__(self, batch_fn, max_batch_size=DEFAULT_MAX_BATCH_SIZE, window=DEFAULT_WINDOW):
+        """
+        `batch_fn` takes a list of items and returns the list of their results, in the same order
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._latencies = deque(maxlen=STATS_HISTORY)
+        self._completions = deque(maxlen=STATS_HISTORY)
+        self._batch_sizes = deque(maxlen=STATS_HISTORY)
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, item, timeout=None):
+        """
+        Queues `item` for the next batch and waits for its result (re-raising the batch's error, if any)
+        """
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('Batcher is closed')
+            self._queue.append((item, future, time.perf_counter()))
+            self._condition.notify()
+
+        return future.result(timeout)
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._queue and not self._closed:
+                self._condition.wait()
+            if not self._queue:
+                return None
+
+            # The window opens with the oldest waiting request
+            deadline = self._queue[0][2] + self.window
+            while len(self._queue) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            return [self._queue.popleft() for _ in range(min(self.max_batch_size, len(self._queue)))]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            items = [item for item, _, _ in batch]
+            try:
+                results = list(self.batch_fn(items))
+                # With results missing (or extra) it is unknown which belongs to which item: fail them all
+                if len(results) != len(items):
+                    raise ValueError(f'Batch of {len(items)} items returned {len(results)} results')
+            except Exception as error:
+                logger.exception(f'Batch of {len(items)} failed')
+                for _, future, _ in batch:
+                    future.set_exception(error)
+                continue
+
+            now = time.perf_counter()
+            for (_, future, submitted), result in zip(batch, results):
+                future.set_result(result)
+                self._latencies.append(now - submitted)
+                self._completions.append(now)
+            self._batch_sizes.append(len(batch))
+
+    def close(self):
+        """
+        Stops accepting items. Already queued items are still processed.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        """
+        Throughput (requests/s) and latency percentiles (seconds) over the recent requests
+        """
+        latencies = list(self._latencies)
+        completions = list(self._completions)
+        batch_sizes = list(self._batch_sizes)
+
+        span = completions[-1] - completions[0] if len(completions) > 1 else 0
+        return {
+            'window': self.window,
+            'max_batch_size': self.max_batch_size,
+            'queued': len(self._queue),
+            'throughput': (len(completions) - 1) / span if span else 0.0,
+            'latency_p50': float(np.percentile(latencies, 50)) if latencies else 0.0,
+            'latency_p99': float(np.percentile(latencies, 99)) if latencies else 0.0,
+            'mean_batch_size': float(np.mean(batch_sizes)) if batch_sizes else 0.0,
+        }
@@ -0,0 +1,82 @@
+"""
+Latency of a per-request detect.run (what /predict used to do) against the resident InferenceEngine.
+
+A small YOLOv5 model with random weights is generated locally, so the benchmark needs neither a
+download nor a GPU. Run it from the yolov5 repo root (the service's working directory):
+
+    python benchmark_engine.py --requests 20 --cfg models/yolov5n.yaml
+"""
+from pathlib import Path
+import argparse
+import statistics
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+from engine import InferenceEngine
+
+
+def generate_model(cfg, weights_path, num_classes=80):
+    """
+    Builds a YOLOv5 model from `cfg` with random weights and saves it as a checkpoint
+    """
+    import torch
+    from models.yolo import Model
+
+    model = Model(cfg, nc=num_classes)
+    model.names = {i: f'class{i}' for i in range(num_classes)}
+    torch.save({'model': model, 'epoch': -1}, weights_path)
+
+
+def percentile(latencies, q):
+    return float(np.percentile(latencies, q))
+
+
+def summarize(name, latencies):
+    print(f'{name:<22} mean {statistics.mean(latencies) * 1000:8.1f} ms   '
+          f'p50 {percentile(latencies, 50) * 1000:8.1f} ms   p99 {percentile(latencies, 99) * 1000:8.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cfg', default='models/yolov5n.yaml', help='model config of the generated model')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--img-size', type=int, default=640)
+    args = parser.parse_args()
+
+    from detect import run
+
+    with tempfile.TemporaryDirectory() as workdir:
+        weights = str(Path(workdir) / 'benchmark.pt')
+        generate_model(args.cfg, weights)
+
+        image = (np.random.default_rng(0).random((480, 640, 3)) * 255).astype(np.uint8)
+        image_path = Path(workdir) / 'image.jpg'
+        Image.fromarray(image).save(image_path)
+
+        per_request = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            run(weights=weights, source=str(image_path), imgsz=(args.img_size, args.img_size),
+                project=workdir, name='runs', exist_ok=True, nosave=True)
+            per_request.append(time.perf_counter() - start)
+
+        engine = InferenceEngine(weights=weights, img_size=args.img_size)
+        start = time.perf_counter()
+        engine.load()
+        load_seconds = time.perf_counter() - start
+
+        resident = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            engine.predict([image])
+            resident.append(time.perf_counter() - start)
+
+    summarize('detect.run per request', per_request)
+    summarize('resident engine', resident)
+    print(f'engine load + warm-up (once per process): {load_seconds * 1000:.1f} ms')
+    print(f'speed-up (mean): x{statistics.mean(per_request) / statistics.mean(resident):.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Resident YOLOv5 inference engine.
+
+The model is loaded once per process (lazily on first use, or eagerly with load()) and shared by
+all request threads, instead of detect.run reloading the weights, rebuilding and re-warming the
+model on every request. Images are passed in already decoded.
+"""
+from pathlib import Path
+import functools
+import hashlib
+import io
+import threading
+import time
+import numpy as np
+from loguru import logger
+from PIL import Image
+
+# Root of the yolov5 repo (hubconf.py, models/, utils/). The service runs from it, see the Dockerfile
+YOLOV5_DIR = '.'
+
+
+class Prediction:
+    """
+    Detections of one image: `labels` in the format of detect.run's label files
+    (class name, normalized center and size), plus the image with the boxes drawn on it.
+    """
+
+    def __init__(self, labels, annotated_image):
+        self.labels = labels
+        self.annotated_image = annotated_image
+
+    def encode(self, image_format='JPEG'):
+        """
+        Returns the annotated image encoded in `image_format` (a PIL format name)
+        """
+        buffer = io.BytesIO()
+        Image.fromarray(self.annotated_image).save(buffer, format=image_format)
+        return buffer.getvalue()
+
+
+class InferenceEngine:
+
+    def __init__(self, weights='yolov5s.pt', repo_dir=YOLOV5_DIR, device='cpu', img_size=640,
+                 conf_thres=0.25, iou_thres=0.45):
+        self.weights = weights
+        self.repo_dir = repo_dir
+        self.device = device
+        self.img_size = img_size
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self._model = None
+        self._load_lock = threading.Lock()
+        # The model is not re-entrant, requests take turns (torch still uses all cores per call)
+        self._inference_lock = threading.Lock()
+
+    @functools.cached_property
+    def version(self):
+        """
+        Identifies the model: the weights file name and a hash of its content
+        """
+        weights = Path(self.weights)
+        if not weights.is_file():
+            return weights.name
+
+        digest = hashlib.sha256()
+        with weights.open('rb') as f:
+            for chunk in iter(lambda: f.read(2 ** 20), b''):
+                digest.update(chunk)
+        return f'{weights.name}:{digest.hexdigest()[:16]}'
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def load(self):
+        """
+        Loads and warms up the model, if that did not happen yet. Safe to call from any thread.
+        """
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    self._model = self._load()
+        return self._model
+
+    def _load(self):
+        import torch
+
+        start = time.perf_counter()
+        # AutoShape model: takes decoded images, does the letterboxing, inference and NMS of detect.run
+        model = torch.hub.load(self.repo_dir, 'custom', path=self.weights, source='local',
+                               device=self.device, _verbose=False)
+        model.conf = self.conf_thres
+        model.iou = self.iou_thres
+        model.eval()
+
+        # Warm up on a blank frame, so the first request does not pay for lazy initialization
+        model(np.zeros((self.img_size, self.img_size, 3), dtype=np.uint8), size=self.img_size)
+        logger.info(f'Model {self.weights} loaded and warmed up in {time.perf_counter() - start:.2f}s')
+        return model
+
+    def predict(self, images):
+        """
+        Runs the model on a list of RGB images (HxWx3 uint8 arrays). Returns one Prediction per image.
+        """
+        model = self.load()
+        with self._inference_lock:
+            results = model(list(images), size=self.img_size)
+            annotated_images = results.render()
+
+        predictions = []
+        for detections, annotated_image in zip(results.xywhn, annotated_images):
+            labels = [{
+                'class': results.names[int(class_id)],
+                'class_id': int(class_id),
+                'cx': float(cx),
+                'cy': float(cy),
+                'width': float(width),
+                'height': float(height),
+            } for cx, cy, width, height, _, class_id in detections.tolist()]
+            predictions.append(Prediction(labels, annotated_image))
+
+        return predictions
+
+
+def image_format(filename):
+    """
+    PIL format name for `filename`'s extension (JPEG when unknown)
+    """
+    return Image.registered_extensions().get(Path(filename).suffix.lower(), 'JPEG')
+
+
+def decode_image(source):
+    """
+    Decodes an image (path, file object or encoded bytes) to the RGB array the engine expects
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with Image.open(source) as image:
+        return np.asarray(image.convert('RGB'))
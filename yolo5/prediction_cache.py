@@ -0,0 +1,115 @@
+"""
+Cache of predictions, keyed by the image content and the model version.
+
+The image is identified by its S3 ETag (the MD5 of the content for single-part uploads) or a hash of
+its bytes, so the same photo under another key still hits. Lookups go to an in-process LRU first,
+then to the prediction summaries in MongoDB, which carry the key in `cache_key`. A prediction is only
+published there once its annotated image is in S3 (see put_when_uploaded).
+"""
+from collections import OrderedDict
+import hashlib
+import threading
+from loguru import logger
+
+DEFAULT_MAX_ENTRIES = 1024
+# Fields of a prediction summary a cache hit returns
+CACHED_FIELDS = ('labels', 'predicted_img_path')
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class PredictionCache:
+
+    def __init__(self, collection=None, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        `collection` holds the prediction summaries, None for an in-process cache only
+        """
+        self.collection = collection
+        self.max_entries = max_entries
+        self.memory_hits = 0
+        self.index_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(image_id, model_version):
+        """
+        Cache key of the image identified by `image_id` (ETag or content hash) under `model_version`
+        """
+        return content_hash(f'{image_id}\0{model_version}'.encode())
+
+    def ensure_index(self):
+        if self.collection is not None:
+            self.collection.create_index('cache_key')
+
+    def get(self, key):
+        """
+        Returns the cached labels and predicted_img_path for `key`, or None
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return self._entries[key]
+
+        entry = self._find(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.index_hits += 1
+        self._remember(key, entry)
+        return entry
+
+    def _find(self, key):
+        if self.collection is None:
+            return None
+
+        projection = {field: 1 for field in CACHED_FIELDS}
+        projection['_id'] = 0
+        try:
+            return self.collection.find_one({'cache_key': key}, projection, sort=[('time', -1)])
+        except Exception:
+            logger.exception(f'Prediction cache lookup of {key} failed')
+            return None
+
+    def put(self, key, summary):
+        """
+        Caches the prediction of `summary` (a prediction summary) under `key`
+        """
+        self._remember(key, {field: summary[field] for field in CACHED_FIELDS})
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put_when_uploaded(self, key, summary, upload, store):
+        """
+        Once `upload` (the Future of the annotated image's upload) is done, caches `summary` under `key`
+        and hands it to `store` (which writes it to the collection) if the upload succeeded. Otherwise
+        it is stored without its cache_key: no lookup returns a predicted_img_path missing from S3.
+        """
+        def done(future):
+            if not future.cancelled() and future.exception() is None:
+                self.put(key, summary)
+                store(summary)
+            else:
+                logger.warning(f'Prediction {summary.get("prediction_id")} not cached, its upload failed')
+                store({field: value for field, value in summary.items() if field != 'cache_key'})
+
+        upload.add_done_callback(done)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'memory_hits': self.memory_hits,
+                'index_hits': self.index_hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,143 @@
+"""
+Buffered bulk writer of prediction summaries to MongoDB.
+
+Requests append their summary to a bounded buffer and return. A background thread writes the
+buffer with insert_many once `batch_size` documents are waiting or the oldest one waited
+`flush_interval` seconds. When the buffer is full, writers block (up to a timeout) until it drains.
+"""
+from collections import deque
+import threading
+import time
+from loguru import logger
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_MAX_BUFFERED = 10000
+
+
+class BufferFull(Exception):
+    pass
+
+
+class BulkWriter:
+
+    def __init__(self, collection, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_buffered=DEFAULT_MAX_BUFFERED, on_batch=None):
+        """
+        `on_batch`, if given, is called with the size and duration (seconds) of every insert_many
+        """
+        self.collection = collection
+        self.on_batch = on_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self._buffer = deque()
+        self._writing = 0
+        self._flushing = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='bulk-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, document, timeout=None):
+        """
+        Queues a copy of `document` for insertion (insert_many adds `_id` to the documents it writes).
+        Blocks while the buffer is full, raising BufferFull if it did not drain within `timeout` seconds.
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('Writer is closed')
+            if not self._condition.wait_for(lambda: len(self._buffer) < self.max_buffered, timeout):
+                raise BufferFull(f'{len(self._buffer)} documents waiting to be written')
+
+            self._buffer.append((dict(document), time.monotonic()))
+            # The first document starts the flush interval, a full batch is written right away
+            if len(self._buffer) == 1 or len(self._buffer) >= self.batch_size:
+                self._condition.notify_all()
+
+    def _next_batch(self):
+        with self._condition:
+            while True:
+                if self._buffer:
+                    deadline = self._buffer[0][1] + self.flush_interval
+                    if (len(self._buffer) >= self.batch_size or self._closed or self._flushing
+                            or time.monotonic() >= deadline):
+                        break
+                    self._condition.wait(deadline - time.monotonic())
+                elif self._closed:
+                    return None
+                else:
+                    self._condition.wait()
+
+            batch = [self._buffer.popleft()[0] for _ in range(min(self.batch_size, len(self._buffer)))]
+            self._writing = len(batch)
+            # Room in the buffer for blocked writers
+            self._condition.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            start = time.perf_counter()
+            written = self._insert(batch)
+            if self.on_batch:
+                self.on_batch(len(batch), time.perf_counter() - start)
+            with self._condition:
+                self.written += written
+                self.failed += len(batch) - written
+                self.batches += 1
+                self._writing = 0
+                self._condition.notify_all()
+
+    def _insert(self, batch):
+        """
+        Writes `batch`, returns the number of documents written
+        """
+        from pymongo.errors import BulkWriteError
+
+        try:
+            # Unordered: one bad document does not stop the rest of the batch
+            self.collection.insert_many(batch, ordered=False)
+            return len(batch)
+        except BulkWriteError as error:
+            logger.error(f'{len(error.details["writeErrors"])} of {len(batch)} prediction summaries not written')
+            return error.details['nInserted']
+        except Exception:
+            logger.exception(f'Writing {len(batch)} prediction summaries failed')
+            return 0
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued document was written (or failed). Returns False on timeout.
+        """
+        with self._condition:
+            self._flushing += 1
+            self._condition.notify_all()
+            try:
+                return self._condition.wait_for(lambda: not self._buffer and not self._writing, timeout)
+            finally:
+                self._flushing -= 1
+
+    def close(self):
+        """
+        Stops accepting documents and writes the buffered ones
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'buffered': len(self._buffer),
+                'written': self.written,
+                'failed': self.failed,
+                'batches': self.batches,
+            }
@@ -0,0 +1,69 @@
+import unittest
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from yolo5.batching import MicroBatcher
+
+
+class TestMicroBatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+        def batch_fn(items):
+            self.batches.append(list(items))
+            return [item * 10 for item in items]
+
+        self.batcher = MicroBatcher(batch_fn, max_batch_size=4, window=0.05)
+
+    def tearDown(self):
+        self.batcher.close()
+
+    def test_results_are_split_back(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(self.batcher.submit, range(8)))
+
+        self.assertEqual(results, [item * 10 for item in range(8)])
+        self.assertLess(len(self.batches), 8)
+        self.assertTrue(all(len(batch) <= 4 for batch in self.batches))
+
+    def test_single_request_waits_at_most_the_window(self):
+        start = time.perf_counter()
+        self.assertEqual(self.batcher.submit(1), 10)
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(self.batches, [[1]])
+
+    def test_errors_reach_every_request(self):
+        failing = MicroBatcher(lambda items: 1 / 0, window=0.01)
+        with self.assertRaises(ZeroDivisionError):
+            failing.submit(1)
+        failing.close()
+
+    def test_missing_results_fail_every_request(self):
+        # A result short must not leave requests waiting forever
+        short = MicroBatcher(lambda items: items[1:], max_batch_size=2, window=1)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(short.submit, item, 5) for item in (1, 2)]
+            for future in futures:
+                with self.assertRaises(ValueError):
+                    future.result()
+        short.close()
+
+    def test_stats(self):
+        barrier = threading.Barrier(4)
+
+        def submit(item):
+            barrier.wait()
+            return self.batcher.submit(item)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(submit, range(4)))
+
+        stats = self.batcher.stats()
+        self.assertGreater(stats['latency_p99'], 0)
+        self.assertGreaterEqual(stats['latency_p99'], stats['latency_p50'])
+        self.assertGreater(stats['mean_batch_size'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
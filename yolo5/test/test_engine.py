@@ -0,0 +1,93 @@
+import unittest
+import tempfile
+from pathlib import Path
+import numpy as np
+from yolo5.engine import InferenceEngine, Prediction, decode_image, image_format
+
+
+class TestPrediction(unittest.TestCase):
+
+    def setUp(self):
+        image = np.zeros((32, 48, 3), dtype=np.uint8)
+        image[8:24, 12:36] = (255, 0, 0)
+        self.labels = [{'class': 'person', 'class_id': 0, 'cx': 0.5, 'cy': 0.5, 'width': 0.5, 'height': 0.5}]
+        self.prediction = Prediction(self.labels, image)
+
+    def test_encode_round_trip(self):
+        data = self.prediction.encode('PNG')
+        self.assertTrue(data.startswith(b'\x89PNG'))
+        self.assertTrue(np.array_equal(decode_image(data), self.prediction.annotated_image))
+
+    def test_encode_jpeg(self):
+        decoded = decode_image(self.prediction.encode(image_format('photo.jpg')))
+        self.assertEqual(decoded.shape, (32, 48, 3))
+
+    def test_image_format(self):
+        self.assertEqual(image_format('photos/a.png'), 'PNG')
+        self.assertEqual(image_format('photos/a.JPEG'), 'JPEG')
+        self.assertEqual(image_format('photos/a'), 'JPEG')
+
+
+class StubResults:
+    """
+    The parts of YOLOv5's Detections the engine reads: normalized xywh rows (with confidence and
+    class id) per image, the rendered images and the class names
+    """
+
+    def __init__(self, images, detections):
+        self.xywhn = [np.array(rows, dtype=np.float32).reshape(-1, 6) for rows in detections]
+        self.names = {0: 'person', 16: 'dog'}
+        self._images = images
+
+    def render(self):
+        return [image + 1 for image in self._images]
+
+
+class StubModel:
+
+    def __init__(self, detections):
+        self.detections = detections
+        self.calls = []
+
+    def __call__(self, images, size):
+        self.calls.append((len(images), size))
+        return StubResults(images, self.detections)
+
+
+class TestInferenceEngine(unittest.TestCase):
+
+    def test_predict(self):
+        engine = InferenceEngine(img_size=320)
+        engine._model = StubModel([
+            [[0.5, 0.25, 0.2, 0.4, 0.9, 0], [0.1, 0.2, 0.3, 0.4, 0.6, 16]],
+            [],
+        ])
+        images = [np.zeros((32, 48, 3), dtype=np.uint8), np.full((16, 16, 3), 7, dtype=np.uint8)]
+
+        first, second = engine.predict(images)
+
+        self.assertEqual(engine._model.calls, [(2, 320)])
+        self.assertEqual([label['class'] for label in first.labels], ['person', 'dog'])
+        self.assertEqual(first.labels[1]['class_id'], 16)
+        for key, expected in zip(('cx', 'cy', 'width', 'height'), (0.5, 0.25, 0.2, 0.4)):
+            self.assertAlmostEqual(first.labels[0][key], expected, places=6)
+            self.assertIsInstance(first.labels[0][key], float)
+        self.assertEqual(second.labels, [])
+        # Each prediction carries its own rendered image
+        self.assertTrue(np.array_equal(first.annotated_image, images[0] + 1))
+        self.assertTrue(np.array_equal(second.annotated_image, images[1] + 1))
+
+    def test_version(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            weights = Path(workdir) / 'model.pt'
+            weights.write_bytes(b'weights v1')
+            version = InferenceEngine(weights=str(weights)).version
+            weights.write_bytes(b'weights v2')
+
+            self.assertTrue(version.startswith('model.pt:'))
+            self.assertNotEqual(InferenceEngine(weights=str(weights)).version, version)
+            self.assertEqual(InferenceEngine(weights='yolov5s.pt').version, 'yolov5s.pt')
+
+
+if __name__ == '__main__':
+    unittest.main()
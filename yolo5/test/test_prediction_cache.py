@@ -0,0 +1,84 @@
+import unittest
+from unittest.mock import Mock
+from concurrent.futures import Future
+import mongomock
+from yolo5.prediction_cache import PredictionCache
+
+SUMMARY = {
+    'prediction_id': '1',
+    'original_img_path': 'photos/a.jpeg',
+    'predicted_img_path': 'photos/predicted_a.jpeg',
+    'labels': [{'class': 'person', 'cx': 0.5, 'cy': 0.5, 'width': 0.2, 'height': 0.4}],
+    'time': 1.0,
+}
+
+
+class TestPredictionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient()['db']['predictions']
+        self.cache = PredictionCache(self.collection, max_entries=2)
+        self.cache.ensure_index()
+
+    def test_key(self):
+        self.assertEqual(PredictionCache.key('etag', 'v1'), PredictionCache.key('etag', 'v1'))
+        self.assertNotEqual(PredictionCache.key('etag', 'v1'), PredictionCache.key('etag', 'v2'))
+        self.assertNotEqual(PredictionCache.key('etag', 'v1'), PredictionCache.key('other', 'v1'))
+
+    def test_memory_hit(self):
+        key = PredictionCache.key('etag', 'v1')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, SUMMARY)
+
+        self.assertEqual(self.cache.get(key), {'labels': SUMMARY['labels'],
+                                               'predicted_img_path': 'photos/predicted_a.jpeg'})
+        self.assertEqual(self.cache.stats(), {'entries': 1, 'memory_hits': 1, 'index_hits': 0, 'misses': 1})
+
+    def test_index_hit(self):
+        key = PredictionCache.key('etag', 'v1')
+        self.collection.insert_one(dict(SUMMARY, cache_key=key))
+
+        self.assertEqual(self.cache.get(key)['predicted_img_path'], 'photos/predicted_a.jpeg')
+        # Promoted to the in-process tier
+        self.cache.get(key)
+        self.assertEqual(self.cache.stats()['index_hits'], 1)
+        self.assertEqual(self.cache.stats()['memory_hits'], 1)
+
+    def test_lru_eviction(self):
+        cache = PredictionCache(max_entries=2)
+        for image_id in 'abc':
+            cache.put(image_id, SUMMARY)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_published_once_uploaded(self):
+        key = PredictionCache.key('etag', 'v1')
+        upload = Future()
+        self.cache.put_when_uploaded(key, dict(SUMMARY, cache_key=key), upload, self.collection.insert_one)
+        self.assertIsNone(self.cache.get(key))
+
+        upload.set_result('photos/predicted_a.jpeg')
+        self.assertEqual(self.cache.get(key)['predicted_img_path'], 'photos/predicted_a.jpeg')
+        self.assertIsNotNone(PredictionCache(self.collection).get(key))
+
+    def test_failed_upload_is_not_cached(self):
+        # Neither tier may point to an annotated image that is not in S3
+        key = PredictionCache.key('etag', 'v1')
+        upload = Future()
+        self.cache.put_when_uploaded(key, dict(SUMMARY, cache_key=key), upload, self.collection.insert_one)
+        upload.set_exception(ConnectionError('S3 is down'))
+
+        self.assertIsNone(self.cache.get(key))
+        self.assertIsNone(PredictionCache(self.collection).get(key))
+        # The prediction itself is still stored
+        self.assertEqual(self.collection.count_documents({'prediction_id': '1'}), 1)
+
+    def test_lookup_errors_are_misses(self):
+        collection = Mock()
+        collection.find_one.side_effect = ConnectionError('mongo is down')
+        self.assertIsNone(PredictionCache(collection).get('a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
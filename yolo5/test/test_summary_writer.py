@@ -0,0 +1,86 @@
+import unittest
+import threading
+from unittest.mock import Mock
+import mongomock
+from pymongo.errors import BulkWriteError
+from yolo5.summary_writer import BufferFull, BulkWriter
+
+
+class TestBulkWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient()['db']['predictions']
+
+    def test_batches_by_size(self):
+        batches = []
+        writer = BulkWriter(self.collection, batch_size=5, flush_interval=60,
+                            on_batch=lambda size, seconds: batches.append(size))
+        for i in range(10):
+            writer.write({'prediction_id': str(i)})
+
+        self.assertTrue(writer.flush(timeout=10))
+        self.assertEqual(self.collection.count_documents({}), 10)
+        self.assertEqual(writer.stats()['batches'], 2)
+        self.assertEqual(batches, [5, 5])
+        writer.close()
+
+    def test_flushes_by_time(self):
+        writer = BulkWriter(self.collection, batch_size=100, flush_interval=0.05)
+        writer.write({'prediction_id': '1'})
+
+        with writer._condition:
+            self.assertTrue(writer._condition.wait_for(lambda: writer.written == 1, timeout=10))
+        self.assertEqual(self.collection.count_documents({}), 1)
+        writer.close()
+
+    def test_documents_are_copied(self):
+        writer = BulkWriter(self.collection)
+        summary = {'prediction_id': '1'}
+        writer.write(summary)
+        writer.close()
+
+        self.assertNotIn('_id', summary)
+        self.assertEqual(self.collection.find_one()['prediction_id'], '1')
+
+    def test_close_writes_buffered_documents(self):
+        writer = BulkWriter(self.collection, batch_size=100, flush_interval=60)
+        for i in range(3):
+            writer.write({'prediction_id': str(i)})
+        writer.close()
+
+        self.assertEqual(self.collection.count_documents({}), 3)
+        with self.assertRaises(RuntimeError):
+            writer.write({'prediction_id': '4'})
+
+    def test_backpressure(self):
+        release = threading.Event()
+        collection = Mock()
+        collection.insert_many.side_effect = lambda batch, ordered: release.wait()
+        writer = BulkWriter(collection, batch_size=1, flush_interval=0, max_buffered=1)
+
+        writer.write({'prediction_id': '1'})
+        writer.flush(timeout=0.2)  # the first document is being written, blocked
+        writer.write({'prediction_id': '2'})
+        with self.assertRaises(BufferFull):
+            writer.write({'prediction_id': '3'}, timeout=0.1)
+
+        release.set()
+        writer.close()
+        self.assertEqual(writer.stats()['written'], 2)
+
+    def test_failed_writes_are_counted(self):
+        collection = Mock()
+        collection.insert_many.side_effect = [
+            BulkWriteError({'writeErrors': [{'index': 0}], 'nInserted': 2}),
+            ConnectionError('mongo is down'),
+        ]
+        writer = BulkWriter(collection, batch_size=3, flush_interval=60)
+        for i in range(6):
+            writer.write({'prediction_id': str(i)})
+        writer.close()
+
+        self.assertEqual(writer.stats(), {'buffered': 0, 'written': 2, 'failed': 4, 'batches': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+from unittest.mock import patch
+import os
+from moto import mock_aws
+from yolo5.transfer import S3Transfer, make_client
+
+BUCKET = 'images'
+
+
+class TestS3Transfer(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+        self.mock = mock_aws()
+        self.mock.start()
+        self.client = make_client(region_name='us-east-1')
+        self.client.create_bucket(Bucket=BUCKET)
+        self.transfer = S3Transfer(self.client, BUCKET, small_object_bytes=1024)
+
+    def tearDown(self):
+        self.transfer.shutdown()
+        self.mock.stop()
+
+    def test_client_pool(self):
+        self.assertEqual(make_client(max_pool_connections=7, region_name='us-east-1').meta.config.max_pool_connections, 7)
+
+    def test_download_small(self):
+        self.client.put_object(Bucket=BUCKET, Key='photos/small.jpeg', Body=b'small image')
+        self.assertEqual(self.transfer.download('photos/small.jpeg'), b'small image')
+
+    def test_download_large(self):
+        data = os.urandom(64 * 1024)
+        self.client.put_object(Bucket=BUCKET, Key='photos/large.jpeg', Body=data)
+        self.assertEqual(self.transfer.download('photos/large.jpeg'), data)
+
+    def test_large_download_is_not_read_whole_first(self):
+        data = os.urandom(64 * 1024)
+        self.client.put_object(Bucket=BUCKET, Key='photos/large.jpeg', Body=data)
+
+        for size in (None, len(data)):
+            with patch.object(self.client, 'get_object', wraps=self.client.get_object) as get_object:
+                self.assertEqual(self.transfer.download('photos/large.jpeg', size), data)
+            # Every GET asks for a range, none for the whole object
+            self.assertTrue(all('Range' in call.kwargs for call in get_object.call_args_list))
+
+    def test_download_with_known_size(self):
+        self.client.put_object(Bucket=BUCKET, Key='photos/small.jpeg', Body=b'small image')
+        etag, size = self.transfer.head('photos/small.jpeg')
+        self.assertEqual(size, len(b'small image'))
+        self.assertEqual(self.transfer.download('photos/small.jpeg', size), b'small image')
+
+    def test_download_empty(self):
+        self.client.put_object(Bucket=BUCKET, Key='photos/empty.jpeg', Body=b'')
+        self.assertEqual(self.transfer.download('photos/empty.jpeg'), b'')
+
+    def test_etag(self):
+        self.client.put_object(Bucket=BUCKET, Key='photos/a.jpeg', Body=b'image')
+        self.client.put_object(Bucket=BUCKET, Key='photos/b.jpeg', Body=b'image')
+        self.assertEqual(self.transfer.etag('photos/a.jpeg'), self.transfer.etag('photos/b.jpeg'))
+        self.assertNotIn('"', self.transfer.etag('photos/a.jpeg'))
+
+    def test_download_missing(self):
+        with self.assertRaises(self.client.exceptions.NoSuchKey):
+            self.transfer.download('photos/missing.jpeg')
+
+    def test_upload_async(self):
+        self.transfer.upload_async('prediction-1', 'photos/predicted_a.jpeg', b'annotated')
+        self.transfer.wait('prediction-1', timeout=10)
+
+        self.assertEqual(self.transfer.upload_status('prediction-1'), 'done')
+        self.assertEqual(self.transfer.pending_uploads(), 0)
+        body = self.client.get_object(Bucket=BUCKET, Key='photos/predicted_a.jpeg')['Body'].read()
+        self.assertEqual(body, b'annotated')
+        self.assertIsNone(self.transfer.upload_status('unknown'))
+
+    def test_failed_upload(self):
+        transfer = S3Transfer(self.client, 'no-such-bucket')
+        transfer.upload_async('prediction-2', 'photos/predicted_a.jpeg', b'annotated')
+        with self.assertRaises(Exception):
+            transfer.wait('prediction-2', timeout=10)
+        self.assertEqual(transfer.upload_status('prediction-2'), 'failed')
+        transfer.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+import time
+from unittest.mock import patch
+from polybot.metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_spans_and_render(self):
+        metrics = Metrics(buckets=(0.01, 0.1))
+        with metrics.span('s3_download', 'prediction-1'):
+            time.sleep(0.02)
+        metrics.gauge('batch_queue_depth', lambda: 2)
+
+        self.assertEqual([stage for stage, _ in metrics.trace('prediction-1')], ['s3_download'])
+        text = metrics.render()
+        self.assertIn('stage_latency_seconds_bucket{stage="s3_download",le="0.1"} 1', text)
+        self.assertIn('batch_queue_depth 2', text)
+
+    def test_profiler_toggle(self):
+        metrics = Metrics()
+        metrics.start_profiler(interval=0.001)
+        time.sleep(0.05)
+        metrics.stop_profiler()
+        self.assertFalse(metrics.profiler.running)
+        self.assertTrue(metrics.profiler.collapsed())
+
+    def test_debug_routes_need_the_token(self):
+        with patch.dict('os.environ', {'METRICS_DEBUG_TOKEN': 'prediction-debug'}):
+            metrics = Metrics()
+        self.assertTrue(metrics.allows_debug('prediction-debug'))
+        self.assertFalse(metrics.allows_debug('other'))
+
+        with patch.dict('os.environ', clear=True):
+            self.assertFalse(Metrics().allows_debug(''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+"""
+S3 transfers of the yolo5 service.
+
+One S3 client (and its connection pool) is shared by all request threads. Small images are read
+with a single in-memory get_object, larger ones with a concurrent ranged download. Uploads of
+annotated images run in the background and are tracked by prediction id, so responses don't wait on them.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import io
+import threading
+from loguru import logger
+
+DEFAULT_MAX_POOL_CONNECTIONS = 32
+DEFAULT_UPLOAD_WORKERS = 8
+# Objects up to this size are read in one get_object call
+DEFAULT_SMALL_OBJECT_BYTES = 8 * 2 ** 20
+# Finished uploads whose status is remembered
+DEFAULT_REMEMBERED_UPLOADS = 10000
+
+
+def make_client(max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS, **kwargs):
+    """
+    S3 client with a connection pool sized for the service's concurrency, keep-alive and adaptive retries
+    """
+    import boto3
+    from botocore.config import Config
+
+    config = Config(max_pool_connections=max_pool_connections,
+                    tcp_keepalive=True,
+                    retries={'max_attempts': 5, 'mode': 'adaptive'})
+    return boto3.client('s3', config=config, **kwargs)
+
+
+class S3Transfer:
+
+    def __init__(self, client, bucket, upload_workers=DEFAULT_UPLOAD_WORKERS,
+                 small_object_bytes=DEFAULT_SMALL_OBJECT_BYTES, remembered_uploads=DEFAULT_REMEMBERED_UPLOADS):
+        self.client = client
+        self.bucket = bucket
+        self.small_object_bytes = small_object_bytes
+        self.remembered_uploads = remembered_uploads
+        self._uploads = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=upload_workers, thread_name_prefix='s3-upload')
+
+    def head(self, key):
+        """
+        ETag and size of `key` (a HEAD request, the content is not transferred)
+        """
+        response = self.client.head_object(Bucket=self.bucket, Key=key)
+        return response['ETag'].strip('"'), response['ContentLength']
+
+    def etag(self, key):
+        """
+        ETag of `key`, see `head`
+        """
+        return self.head(key)[0]
+
+    def download(self, key, size=None):
+        """
+        Returns the content of `key`. `size`, its length if already known (see `head`), picks between
+        one get_object and a concurrent ranged download. Without it, the first `small_object_bytes` are
+        requested, all there is of a small object.
+        """
+        from botocore.exceptions import ClientError
+
+        if size is None:
+            try:
+                response = self.client.get_object(Bucket=self.bucket, Key=key,
+                                                  Range=f'bytes=0-{self.small_object_bytes - 1}')
+            except ClientError as error:
+                # No range of an empty object is satisfiable
+                if error.response['Error']['Code'] == 'InvalidRange':
+                    return b''
+                raise
+            size = int(response['ContentRange'].rsplit('/', 1)[1])
+            # Closed unread for a large object, so at most its first range was sent
+            with response['Body'] as body:
+                if size <= self.small_object_bytes:
+                    return body.read()
+        elif size <= self.small_object_bytes:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+            with response['Body'] as body:
+                return body.read()
+
+        # Large object: parallel ranged GETs instead of one long stream
+        from boto3.s3.transfer import TransferConfig
+
+        buffer = io.BytesIO()
+        self.client.download_fileobj(self.bucket, key, buffer,
+                                     Config=TransferConfig(multipart_threshold=self.small_object_bytes))
+        return buffer.getvalue()
+
+    def upload_async(self, prediction_id, key, data):
+        """
+        Uploads `data` to `key` in the background. Returns the Future of the upload.
+        """
+        future = self._executor.submit(self._upload, prediction_id, key, data)
+        with self._lock:
+            self._uploads[prediction_id] = future
+            # Forget the oldest finished uploads (dicts keep insertion order)
+            for old_id in list(self._uploads)[:max(0, len(self._uploads) - self.remembered_uploads)]:
+                if self._uploads[old_id].done():
+                    del self._uploads[old_id]
+        return future
+
+    def _upload(self, prediction_id, key, data):
+        try:
+            self.client.upload_fileobj(io.BytesIO(data), self.bucket, key)
+        except Exception:
+            logger.exception(f'prediction: {prediction_id}. Upload of {key} failed')
+            raise
+        logger.info(f'prediction: {prediction_id}. {key} uploaded to S3')
+        return key
+
+    def upload_status(self, prediction_id):
+        """
+        'pending', 'done' or 'failed', or None for unknown prediction ids
+        """
+        with self._lock:
+            future = self._uploads.get(prediction_id)
+        if future is None:
+            return None
+        if not future.done():
+            return 'pending'
+        return 'failed' if future.exception() else 'done'
+
+    def pending_uploads(self):
+        with self._lock:
+            return sum(not future.done() for future in self._uploads.values())
+
+    def wait(self, prediction_id, timeout=None):
+        """
+        Waits for the upload of `prediction_id` (re-raising its error, if any)
+        """
+        with self._lock:
+            future = self._uploads.get(prediction_id)
+        if future is not None:
+            future.result(timeout)
+
+    def shutdown(self, wait=True):
+        """
+        Stops accepting uploads, by default waiting for the pending ones
+        """
+        self._executor.shutdown(wait=wait)